@@ -0,0 +1,45 @@
+"""End-to-end time of create_html against create_pdf on the same Markdown.
+
+Run from LLM_Export: python tests/benchmark_html_export.py [copies]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("FILE_EXPORT_DIR", tempfile.mkdtemp(prefix="file_export_bench_"))
+# The repo documents contain image_query examples, which warn without UNSPLASH_ACCESS_KEY.
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import file_export_mcp as mcp
+
+DOCUMENTS = ["README.md", "Prompt_Examples.md", "Best_Practices.md"]
+
+
+def _best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(copies: int = 5):
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    parts = []
+    for name in DOCUMENTS:
+        with open(os.path.join(root, name), encoding="utf-8") as f:
+            parts.append(f.read())
+    text = ["\n\n".join(parts) * copies]
+    mib = len(text[0].encode("utf-8")) / (1024 * 1024)
+    print(f"{mib:.2f} MiB of Markdown ({copies} copies of {', '.join(DOCUMENTS)})")
+    html_time = _best_of(lambda: mcp.create_html(text, persistent=True))
+    pdf_time = _best_of(lambda: mcp.create_pdf(text, persistent=True))
+    print(f"{'create_html':<12} {html_time:>8.3f}s")
+    print(f"{'create_pdf':<12} {pdf_time:>8.3f}s  x{pdf_time / html_time:.1f} slower")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
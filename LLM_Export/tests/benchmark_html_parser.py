@@ -0,0 +1,50 @@
+"""Throughput of each HTML parser backend on the PDF_RENDERER=html path.
+
+Run from LLM_Export: python tests/benchmark_html_parser.py [copies]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("FILE_EXPORT_DIR", tempfile.mkdtemp(prefix="file_export_bench_"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import file_export_mcp as mcp
+
+BACKENDS = ["lxml", "html5lib", "html.parser"]
+DOCUMENTS = ["README.md", "Prompt_Examples.md", "Best_Practices.md"]
+
+
+def _best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(copies: int = 20):
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    parts = []
+    for name in DOCUMENTS:
+        with open(os.path.join(root, name), encoding="utf-8") as f:
+            parts.append(f.read())
+    html_text = mcp._markdown2_html("\n\n".join(parts) * copies)
+    mib = len(html_text.encode("utf-8")) / (1024 * 1024)
+    print(f"{mib:.2f} MiB of HTML ({copies} copies of {', '.join(DOCUMENTS)})")
+    print(f"{'backend':<12} {'parse':>10} {'parse+story':>12}")
+    for backend in BACKENDS:
+        if mcp._resolve_html_parser(backend) != backend:
+            print(f"{backend:<12} {'not installed':>23}")
+            continue
+        mcp.HTML_PARSER_BACKEND = backend
+        parse = _best_of(lambda: mcp._parse_html(html_text))
+        story = _best_of(lambda: mcp.render_html_elements(mcp._parse_html(html_text), mcp.ImageRegistry()))
+        print(f"{backend:<12} {mib / parse:>6.2f} MiB/s {mib / story:>8.2f} MiB/s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,66 @@
+"""Per-element cost of the debug logging on the PDF_RENDERER=html path.
+
+"eager" stands in for the old f-string calls: every message is formatted and then dropped at INFO.
+Run from LLM_Export: python tests/benchmark_logging.py [copies]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("FILE_EXPORT_DIR", tempfile.mkdtemp(prefix="file_export_bench_"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import file_export_mcp as mcp
+
+DOCUMENTS = ["README.md", "Prompt_Examples.md", "Best_Practices.md"]
+
+
+def _best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _eager_debug(msg, *args, **kwargs):
+    msg % args
+
+
+def main(copies: int = 10):
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    parts = []
+    for name in DOCUMENTS:
+        with open(os.path.join(root, name), encoding="utf-8") as f:
+            parts.append(f.read())
+    mcp.PDF_RENDERER = "html"
+    soup = mcp._parse_html(mcp._markdown2_html("\n\n".join(parts) * copies))
+    elements = sum(1 for _ in soup.children)
+    with open(os.devnull, "w") as devnull:
+        for handler in logging.getLogger().handlers:
+            handler.setStream(devnull)
+        cases = [
+            ("eager, INFO", logging.DEBUG, 1, _eager_debug),
+            ("lazy, INFO", logging.INFO, 1, None),
+            ("DEBUG, sampling 1", logging.DEBUG, 1, None),
+            ("DEBUG, sampling 100", logging.DEBUG, 100, None),
+        ]
+        print(f"{elements} top-level elements ({copies} copies of {', '.join(DOCUMENTS)})")
+        print(f"{'logging':<20} {'story':>9} {'per element':>12}")
+        for label, level, sampling, debug in cases:
+            mcp.log.setLevel(level)
+            logging.getLogger().setLevel(level)
+            mcp.LOG_ELEMENT_SAMPLING = sampling
+            if debug:
+                mcp.log.debug = debug
+            elapsed = _best_of(lambda: mcp.render_html_elements(soup, mcp.ImageRegistry()))
+            mcp.log.__dict__.pop("debug", None)
+            print(f"{label:<20} {elapsed:>8.3f}s {elapsed / elements * 1e6:>9.1f} us")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,52 @@
+"""Story build time of PDF_RENDERER=markdown against PDF_RENDERER=html.
+
+Run from LLM_Export: python tests/benchmark_markdown_renderer.py [copies]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("FILE_EXPORT_DIR", tempfile.mkdtemp(prefix="file_export_bench_"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import file_export_mcp as mcp
+
+RENDERERS = ["html", "markdown"]
+DOCUMENTS = ["README.md", "Prompt_Examples.md", "Best_Practices.md"]
+
+
+def _best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(copies: int = 20):
+    root = os.path.join(os.path.dirname(__file__), "..", "..")
+    parts = []
+    for name in DOCUMENTS:
+        with open(os.path.join(root, name), encoding="utf-8") as f:
+            parts.append(f.read())
+    md_text = "\n\n".join(parts) * copies
+    mib = len(md_text.encode("utf-8")) / (1024 * 1024)
+    print(f"{mib:.2f} MiB of Markdown ({copies} copies of {', '.join(DOCUMENTS)})")
+    print(f"{'renderer':<10} {'story':>10} {'flowables':>10}")
+    baseline = None
+    for renderer in RENDERERS:
+        if renderer == "markdown" and mcp._markdown_parser is None:
+            print(f"{renderer:<10} {'markdown-it-py not installed':>21}")
+            continue
+        mcp.PDF_RENDERER = renderer
+        elapsed = _best_of(lambda: mcp._markdown_to_story(md_text, mcp.ImageRegistry()))
+        flowables = len(mcp._markdown_to_story(md_text, mcp.ImageRegistry()))
+        baseline = baseline or elapsed
+        print(f"{renderer:<10} {elapsed:>9.3f}s {flowables:>10}  x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""Story build time with the paragraph cache on and off (_PARAGRAPH_CACHE_SIZE=0) on a repetitive document.
+
+Run from LLM_Export: python tests/benchmark_paragraph_cache.py [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("FILE_EXPORT_DIR", tempfile.mkdtemp(prefix="file_export_bench_"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import file_export_mcp as mcp
+
+
+def _best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        mcp._paragraph_cache.clear()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _document(rows: int) -> str:
+    """A status report: the same few cell values, list items and notes over and over."""
+    statuses = ["**Done** :white_check_mark:", "*In progress*", "Blocked :x:", "Not started"]
+    lines = ["# Status report", "", "| Task | Owner | Status |", "|---|---|---|"]
+    lines += [f"| Task {i % 50} | Team {i % 4} | {statuses[i % 4]} |" for i in range(rows)]
+    for i in range(rows // 10):
+        lines += ["", "## Weekly notes", "", "- Review the open items", "- Update the **roadmap**", "", "No changes."]
+    return "\n".join(lines)
+
+
+def main(rows: int = 2000):
+    md_text = _document(rows)
+    print(f"{rows} table rows, {len(md_text.encode('utf-8')) / 1024:.0f} KiB of Markdown")
+    print(f"{'renderer':<10} {'cache on':>10} {'cache off':>10}")
+    size = mcp._PARAGRAPH_CACHE_SIZE
+    for renderer in ["html", "markdown"]:
+        if renderer == "markdown" and mcp._markdown_parser is None:
+            continue
+        mcp.PDF_RENDERER = renderer
+        build = lambda: mcp._markdown_to_story(md_text, mcp.ImageRegistry())
+        mcp._PARAGRAPH_CACHE_SIZE = size
+        cached = _best_of(build)
+        mcp._PARAGRAPH_CACHE_SIZE = 0
+        uncached = _best_of(build)
+        mcp._PARAGRAPH_CACHE_SIZE = size
+        print(f"{renderer:<10} {cached:>9.3f}s {uncached:>9.3f}s  x{uncached / cached:.2f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("FILE_EXPORT_DIR", tempfile.mkdtemp(prefix="file_export_tests_"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import pytest
+import requests
+
+import file_export_mcp as mcp
+
+
+def _export_location(url):
+    """(folder, file name) of an export URL, ignoring any signature query."""
+    folder, name = url.split("?")[0].split("/")[-2:]
+    return folder, name
+
+
+@pytest.fixture
+def export_location():
+    return _export_location
+
+
+@pytest.fixture
+def export_path():
+    def path(url):
+        folder, name = _export_location(url)
+        return os.path.join(mcp._export_folder_path(folder), name)
+    return path
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Make every image download fail; returns the URLs that were requested."""
+    urls = []
+
+    def get(url, *args, **kwargs):
+        urls.append(url)
+        raise requests.ConnectionError(f"no network in tests: {url}")
+    monkeypatch.setattr(mcp.requests, "get", get)
+    return urls
@@ -0,0 +1,29 @@
+import os
+
+import pytest
+from pygments.token import Token
+
+import file_export_mcp as mcp
+
+YAML_FENCE = "```yaml\nservices:\n  app:\n    image: foo\n```"
+
+
+@pytest.mark.skipif(mcp._code_style() is None, reason="pygments not installed")
+def test_token_markup_falls_back_to_parent_token_type():
+    # Token.Literal.Scalar.Plain (YAML) is not defined by the default style.
+    assert mcp._token_markup(Token.Literal.Scalar.Plain) == mcp._token_markup(Token.Literal)
+
+
+def test_create_pdf_highlights_yaml(export_path):
+    url = mcp.create_pdf([YAML_FENCE], persistent=True)["url"]
+    assert os.path.getsize(export_path(url)) > 0
+
+
+def test_create_word_highlights_yaml(export_path):
+    url = mcp.create_word(markdown=[YAML_FENCE], persistent=True)["url"]
+    assert os.path.getsize(export_path(url)) > 0
+
+
+def test_document_set_highlights_yaml(export_path):
+    urls = mcp.create_document_set([YAML_FENCE], formats=["pdf", "docx"], persistent=True)["urls"]
+    assert all(os.path.getsize(export_path(url)) > 0 for url in urls.values())
@@ -0,0 +1,46 @@
+import pytest
+from PIL import Image
+from docx import Document
+from pptx import Presentation
+
+import file_export_mcp as mcp
+
+
+def _pictures(path):
+    return [shape for slide in Presentation(path).slides for shape in slide.shapes if shape.shape_type == 13]
+
+
+@pytest.mark.skipif(mcp._markdown_parser is None, reason="markdown-it-py not installed")
+def test_unreachable_image_is_skipped_and_fetched_once(offline, export_path):
+    markdown = ["# Title\n\n## Section\n\n![x](https://example.invalid/a.png)\n\nSome text."]
+    urls = mcp.create_document_set(markdown, formats=["pptx", "pdf", "docx", "html"], persistent=True)["urls"]
+    assert set(urls) == {"pptx", "pdf", "docx", "html"}
+    assert not _pictures(export_path(urls["pptx"]))
+    assert offline == ["https://example.invalid/a.png"]
+
+
+def test_slide_image_refuses_local_paths(tmp_path, export_path):
+    image = tmp_path / "secret.png"
+    Image.new("RGB", (8, 8)).save(image)
+    slides = [{"title": "Local", "content": ["text"], "image": str(image)}]
+    url = mcp.create_presentation(slides, persistent=True)["url"]
+    assert not _pictures(export_path(url))
+
+
+@pytest.mark.skipif(mcp._markdown_parser is None, reason="markdown-it-py not installed")
+def test_document_set_never_reads_local_image_paths(tmp_path, export_path):
+    image = tmp_path / "secret.png"
+    Image.new("RGB", (8, 8)).save(image)
+    urls = mcp.create_document_set([f"# T\n\n## S\n\n![s]({image})\n\ntext"], formats=["pptx"], persistent=True)["urls"]
+    assert not _pictures(export_path(urls["pptx"]))
+
+
+@pytest.mark.skipif(mcp._markdown_parser is None, reason="markdown-it-py not installed")
+def test_word_exports_never_read_local_image_paths(tmp_path, export_path):
+    image = tmp_path / "secret.png"
+    Image.new("RGB", (8, 8)).save(image)
+    markdown = [f"![a]({image})\n\n![b]({image})"]
+    word = mcp.create_word(markdown=markdown, persistent=True)["url"]
+    document_set = mcp.create_document_set(markdown, formats=["docx"], persistent=True)["urls"]["docx"]
+    for url in (word, document_set):
+        assert not Document(export_path(url)).inline_shapes
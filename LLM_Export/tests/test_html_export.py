@@ -0,0 +1,11 @@
+from PIL import Image
+
+import file_export_mcp as mcp
+
+
+def test_create_html_never_inlines_local_files(tmp_path, export_path):
+    image = tmp_path / "secret.png"
+    Image.new("RGB", (8, 8)).save(image)
+    url = mcp.create_html([f"![s]({image})", f"<img src='{image}'>"], persistent=True)["url"]
+    with open(export_path(url), encoding="utf-8") as f:
+        assert "data:image/png;base64" not in f.read()
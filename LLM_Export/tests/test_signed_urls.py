@@ -0,0 +1,53 @@
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import file_export_mcp as mcp
+
+fastapi_testclient = pytest.importorskip("fastapi.testclient")
+import file_export_server as server
+
+KEY = b"test-signing-key"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(mcp, "SIGNING_KEY", KEY)
+    monkeypatch.setattr(server, "SIGNING_KEY", KEY)
+    return fastapi_testclient.TestClient(server.app)
+
+
+@pytest.fixture
+def request_path(export_location):
+    def path(url):
+        folder, name = export_location(url)
+        return f"/files/{folder}/{name}?{urlsplit(url).query}"
+    return path
+
+
+def test_signed_link_is_served_with_its_size(client, request_path):
+    url = mcp.create_csv([["a", "b"]] * 3, persistent=True)["url"]
+    query = parse_qs(urlsplit(url).query)
+    response = client.get(request_path(url))
+    assert response.status_code == 200
+    assert int(query["size"][0]) == len(response.content)
+    assert query["expires"] == ["0"]
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_tampered_and_unsigned_links_are_refused(client, request_path):
+    url = mcp.create_csv([["a"]], persistent=True)["url"]
+    assert client.get(request_path(url).replace("size=", "size=1")).status_code == 403
+    assert client.get(request_path(url).split("?")[0]).status_code == 403
+
+
+def test_expired_link_is_gone_without_a_lookup(client, monkeypatch):
+    expires = int(time.time()) - 5
+    sig = mcp._url_signature("export_0123456789_20240101_000000", "a.csv", expires, 3)
+
+    def no_lookup(*args):
+        raise AssertionError("expired links must not touch the filesystem")
+    monkeypatch.setattr(server, "_export_file_path", no_lookup)
+    response = client.get(f"/files/export_0123456789_20240101_000000/a.csv?expires={expires}&size=3&sig={sig}")
+    assert response.status_code == 410
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import file_export_mcp as mcp
+
+moto = pytest.importorskip("moto")
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        storage = mcp.S3Storage("exports", prefix="p", chunk_size=5 * 1024 * 1024)
+        storage._client.create_bucket(Bucket="exports")
+        monkeypatch.setattr(storage, "root", str(tmp_path))
+        monkeypatch.setattr(mcp, "storage", storage)
+        yield storage
+
+
+def _keys(storage):
+    return sorted(item["Key"] for item in storage._client.list_objects_v2(Bucket="exports").get("Contents", []))
+
+
+def test_s3_publish_uploads_and_drops_staging_folder(s3, export_location):
+    url = mcp.create_csv([["a", "b"]], filename="data.csv", persistent=True)["url"]
+    folder, _ = export_location(url)
+    assert _keys(s3) == [f"p/{folder}/data.csv"]
+    assert not os.path.exists(mcp._export_folder_path(folder))
+
+
+def test_s3_multipart_upload_and_delete(s3):
+    folder_path = mcp._generate_unique_folder()
+    with open(os.path.join(folder_path, "big.bin"), "wb") as f:
+        f.write(os.urandom(12 * 1024 * 1024))
+    mcp._finalize_export(folder_path, True)
+    key = f"p/{os.path.basename(folder_path)}/big.bin"
+    head = s3._client.head_object(Bucket="exports", Key=key)
+    assert head["ContentLength"] == 12 * 1024 * 1024
+    assert head["ETag"].endswith('-3"')
+    mcp._remove_export_folder(folder_path)
+    assert key not in _keys(s3)
+
+
+def test_public_bucket_links_are_not_signed(s3, monkeypatch):
+    public = mcp.S3Storage("exports", prefix="p", public_url="https://cdn.example.com")
+    monkeypatch.setattr(public, "root", s3.root)
+    monkeypatch.setattr(mcp, "storage", public)
+    monkeypatch.setattr(mcp, "SIGNING_KEY", b"secret")
+    url = mcp.create_csv([["a", "b"]], filename="data.csv", persistent=True)["url"]
+    assert url.startswith("https://cdn.example.com/p/export_") and "?" not in url
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from reportlab.platypus import Flowable, Paragraph, Spacer, Table
+
+import file_export_mcp as mcp
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+DOCUMENTS = ["README.md", "Prompt_Examples.md", "Best_Practices.md"]
+
+SAMPLE = """# Quarterly report
+
+Intro paragraph with **bold**, *italic* and `code` and a [link](https://example.com).
+
+## Figures
+
+| Region | Q1 | Q2 |
+|---|---|---|
+| North | 10 | 12 |
+| South & East | 7 | 9 |
+
+## Notes
+
+- first item
+- second item with `code`
+    - nested item
+
+1. one
+2. two
+
+```python
+def total(values):
+    return sum(values)
+```
+
+### Closing
+
+Final words.
+"""
+
+
+def _read(name):
+    with open(os.path.join(REPO_ROOT, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _signature(flowable, spacers=True):
+    """A comparable description of a flowable: its type, style and text, recursing into tables and lists."""
+    if isinstance(flowable, Paragraph):
+        return (type(flowable).__name__, flowable.style.name, flowable.getPlainText())
+    if isinstance(flowable, Table):
+        return (type(flowable).__name__, [
+            [_signature(c, spacers) if isinstance(c, Flowable) else c for c in row] for row in flowable._cellvalues
+        ])
+    if isinstance(flowable, Spacer):
+        return ("Spacer", flowable.width, flowable.height)
+    children = getattr(flowable, "_flowables", None)
+    if children is not None:
+        return (type(flowable).__name__, _story_signature(children, spacers))
+    return (type(flowable).__name__,)
+
+
+def _story_signature(story, spacers=True):
+    return [_signature(f, spacers) for f in story if spacers or not isinstance(f, Spacer)]
+
+
+def _story(monkeypatch, md_text, renderer, parser="html.parser"):
+    monkeypatch.setattr(mcp, "PDF_RENDERER", renderer)
+    monkeypatch.setattr(mcp, "HTML_PARSER_BACKEND", parser)
+    return list(mcp._markdown_to_story(md_text, mcp.ImageRegistry()))
+
+
+@pytest.mark.skipif(mcp._resolve_html_parser("lxml") != "lxml", reason="lxml not installed")
+@pytest.mark.parametrize("name", DOCUMENTS + ["sample"])
+def test_lxml_and_html_parser_build_the_same_story(monkeypatch, name):
+    md_text = SAMPLE if name == "sample" else _read(name)
+    expected = _story_signature(_story(monkeypatch, md_text, "html", "html.parser"))
+    assert _story_signature(_story(monkeypatch, md_text, "html", "lxml")) == expected
+
+
+@pytest.mark.skipif(mcp._markdown_parser is None, reason="markdown-it-py not installed")
+def test_markdown_and_html_renderers_build_the_same_story(monkeypatch):
+    expected = _story_signature(_story(monkeypatch, SAMPLE, "html"), spacers=False)
+    assert _story_signature(_story(monkeypatch, SAMPLE, "markdown"), spacers=False) == expected
+
+
+@pytest.mark.parametrize("renderer", ["markdown", "html"])
+@pytest.mark.parametrize("name", DOCUMENTS)
+def test_repo_documents_render(monkeypatch, renderer, name):
+    if renderer == "markdown" and mcp._markdown_parser is None:
+        pytest.skip("markdown-it-py not installed")
+    assert _story(monkeypatch, _read(name), renderer)
+
+
+@pytest.mark.parametrize("renderer", ["markdown", "html"])
+def test_literal_tags_in_text_are_not_interpreted(monkeypatch, renderer):
+    if renderer == "markdown" and mcp._markdown_parser is None:
+        pytest.skip("markdown-it-py not installed")
+    md_text = '`<b>` x\n\n&lt;font name="zz"&gt;hi&lt;/font&gt;\n'
+    texts = [f.getPlainText() for f in _story(monkeypatch, md_text, renderer) if isinstance(f, Paragraph)]
+    assert texts == ['<b> x', '<font name="zz">hi</font>']
@@ -1,70 +1,157 @@
 import re
 import os
 import ast
+import html
+import hashlib
+import hmac
 import json
 import uuid
 import emoji
 import time
 import base64
+import shutil
+import sqlite3
 import datetime
 import tarfile
 import zipfile
 import py7zr
 import logging
+import functools
+import contextlib
+import contextvars
+import collections
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import requests
 from requests.auth import HTTPBasicAuth
 import threading
 import markdown2
 import tempfile
-from PIL import Image
+import mimetypes
+from PIL import Image as PILImage
 from docx import Document
-from docx.shared import Inches
+from docx.shared import Inches, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from bs4 import BeautifulSoup, NavigableString
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, qn
+from bs4 import BeautifulSoup, NavigableString, FeatureNotFound
 from mcp.server.fastmcp import FastMCP
 from openpyxl import Workbook
 import csv
 from pptx import Presentation
 from pptx.util import Inches, Pt
+from pptx.enum.shapes import PP_PLACEHOLDER
+from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION
+from pptx.chart.data import CategoryChartData, XyChartData
 from pptx.parts.image import Image
 from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, ListFlowable, ListItem, Image
+from reportlab.platypus import SimpleDocTemplate, Paragraph, XPreformatted, Spacer, ListFlowable, ListItem, LongTable, TableStyle, Image as ReportLabImage
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_LEFT
 from reportlab.lib.units import mm
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.utils import ImageReader
+try:
+    from markdown_it import MarkdownIt
+    from markdown_it.common.utils import escapeHtml
+    from markdown_it.renderer import RendererHTML
+except ImportError:
+    MarkdownIt = None
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = None
+try:
+    from pygments import lex
+    from pygments.lexers import get_lexer_by_name
+    from pygments.styles import get_style_by_name
+    from pygments.util import ClassNotFound
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+except ImportError:
+    lex = None
 
 
-PERSISTENT_FILES = os.getenv("PERSISTENT_FILES", "false")
+PERSISTENT_FILES = os.getenv("PERSISTENT_FILES", "false").strip().lower() == "true"
 FILES_DELAY = int(os.getenv("FILES_DELAY", 60)) 
 
 DEFAULT_PATH_ENV = os.getenv("PYTHONPATH", r"").rstrip("/")
 EXPORT_DIR_ENV = os.getenv("FILE_EXPORT_DIR")
 EXPORT_DIR = (EXPORT_DIR_ENV or os.path.join(DEFAULT_PATH_ENV, "output")).rstrip("/")
 os.makedirs(EXPORT_DIR, exist_ok=True)
+EXPORT_SHARDING = os.getenv("EXPORT_SHARDING", "false").strip().lower() == "true"
+EXPORT_INDEX_PATH = os.getenv("EXPORT_INDEX_PATH") or os.path.join(EXPORT_DIR, ".export_index.sqlite3")
+EXPORT_QUOTA_BYTES = int(os.getenv("EXPORT_QUOTA_BYTES", 0))
+EXPORT_CALLER_QUOTA_BYTES = int(os.getenv("EXPORT_CALLER_QUOTA_BYTES", 0))
+EXPORT_DEDUP = os.getenv("EXPORT_DEDUP", "false").strip().lower() == "true"
+EXPORT_STORAGE = os.getenv("EXPORT_STORAGE", "local").strip().lower()
+EXPORT_STAGING_DIR = os.getenv("EXPORT_STAGING_DIR") or os.path.join(tempfile.gettempdir(), "file_export_staging")
+EXPORT_S3_BUCKET = os.getenv("EXPORT_S3_BUCKET")
+EXPORT_S3_PREFIX = os.getenv("EXPORT_S3_PREFIX", "").strip("/")
+EXPORT_S3_ENDPOINT_URL = os.getenv("EXPORT_S3_ENDPOINT_URL")
+EXPORT_S3_REGION = os.getenv("EXPORT_S3_REGION")
+EXPORT_S3_PUBLIC_URL = (os.getenv("EXPORT_S3_PUBLIC_URL") or "").rstrip("/")
+EXPORT_S3_CHUNK_BYTES = max(5, int(os.getenv("EXPORT_S3_CHUNK_MB", 8))) * 1024 * 1024
+EXPORT_BLOB_DIR = os.path.join(EXPORT_DIR, ".blobs")
 
 
 BASE_URL_ENV = os.getenv("FILE_EXPORT_BASE_URL")
 BASE_URL = (BASE_URL_ENV or "http://localhost:9003/files").rstrip("/")
+SIGNING_KEY = (os.getenv("FILE_EXPORT_SIGNING_KEY") or "").encode()
 
 LOG_LEVEL_ENV = os.getenv("LOG_LEVEL")
 LOG_FORMAT_ENV = os.getenv(
     "LOG_FORMAT", "%(asctime)s %(levelname)s %(name)s - %(message)s"
 )
+LOG_ELEMENT_SAMPLING = max(1, int(os.getenv("LOG_ELEMENT_SAMPLING", 1)))
+
+PDF_RENDERER = os.getenv("PDF_RENDERER", "markdown" if MarkdownIt else "html").strip().lower()
+HTML_PARSER = os.getenv("HTML_PARSER", "auto").strip().lower()
+PDF_STREAMING = os.getenv("PDF_STREAMING", "false").strip().lower() == "true"
+PDF_STREAM_LOOKAHEAD = max(2, int(os.getenv("PDF_STREAM_LOOKAHEAD", 16)))
+# Symbola ships in the mcpo image; DejaVu only covers a small share of emoji but is common on hosts.
+_EMOJI_FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+PDF_EMOJI_FONT = os.getenv("PDF_EMOJI_FONT") or next(
+    (path for path in _EMOJI_FONT_CANDIDATES if os.path.isfile(path)), _EMOJI_FONT_CANDIDATES[0]
+)
+PDF_FONT = os.getenv("PDF_FONT")
+PDF_FONT_BOLD = os.getenv("PDF_FONT_BOLD")
+PDF_FONT_ITALIC = os.getenv("PDF_FONT_ITALIC")
+PDF_FONT_BOLD_ITALIC = os.getenv("PDF_FONT_BOLD_ITALIC")
+PDF_FONT_MONO = os.getenv("PDF_FONT_MONO")
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", 0))
+PDF_PARALLEL_MIN_CHARS = int(os.getenv("PDF_PARALLEL_MIN_CHARS", 200000))
+PDF_CODE_STYLE = os.getenv("PDF_CODE_STYLE", "friendly").strip()
+
+PPTX_TEMPLATE_DIR = os.getenv("PPTX_TEMPLATE_DIR", os.path.join(DEFAULT_PATH_ENV, "templates")).rstrip("/")
+PPTX_METRICS_FONT = os.getenv("PPTX_METRICS_FONT")
 
 def search_image(query):
     image_source = os.getenv("IMAGE_SOURCE", "unsplash")
 
     if image_source == "unsplash":
         return search_unsplash(query)
-    elif image_source == "local_sd":
-        return search_local_sd(query)
     else:
-        log.warning(f"Image source unknown : {image_source}")
+        log.warning("Image source unknown : %s", image_source)
         return None
 
 
-def search_local_sd(query: str):
+def generate_local_sd_images(queries: list[str]) -> dict[str, bytes]:
+    """Generate one image per distinct prompt and return the decoded PNG bytes."""
     SD_URL = os.getenv("LOCAL_SD_URL")
     SD_USERNAME = os.getenv("LOCAL_SD_USERNAME")
     SD_PASSWORD = os.getenv("LOCAL_SD_PASSWORD")
@@ -78,62 +165,57 @@ def search_local_sd(query: str):
 
     if not SD_URL:
         log.warning("LOCAL_SD_URL is not defined.")
-        return None
-
-    payload = {
-        "prompt": query.strip(),
-        "steps": DEFAULT_STEPS,
-        "width": DEFAULT_WIDTH,
-        "height": DEFAULT_HEIGHT,
-        "cfg_scale": DEFAULT_CFG_SCALE,
-        "sampler_name": DEFAULT_SAMPLE,
-        "scheduler": DEFAULT_SCHEDULER,
-        "enable_hr": False,
-        "hr_upscaler": "Latent",
-        "seed": -1,
-        "override_settings": {
-            "sd_model_checkpoint": DEFAULT_MODEL
-        }
-    }
-
-    try:
-        url = f"{SD_URL}/sdapi/v1/txt2img"
-        response = requests.post(
-            url,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            auth=HTTPBasicAuth(SD_USERNAME, SD_PASSWORD),
-            timeout=30
-        )
-        response.raise_for_status()
-        data = response.json()
-
-        images = data.get("images", [])
-        if not images:
-            log.warning(f"No image generated for the request : '{query}'")
-            return None
-
-        image_b64 = images[0]
-        image_data = base64.b64decode(image_b64)
+        return {}
 
-        folder_path = _generate_unique_folder()
-        filename = f"{query.replace(' ', '_')}.png"
-        filepath = os.path.join(folder_path, filename)
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    results = {}
+    url = f"{SD_URL}/sdapi/v1/txt2img"
+    with requests.Session() as session:
+        session.auth = HTTPBasicAuth(SD_USERNAME, SD_PASSWORD)
+        for query in dict.fromkeys(q.strip() for q in queries if q and q.strip()):
+            payload = {
+                "prompt": query,
+                "steps": DEFAULT_STEPS,
+                "width": DEFAULT_WIDTH,
+                "height": DEFAULT_HEIGHT,
+                "cfg_scale": DEFAULT_CFG_SCALE,
+                "sampler_name": DEFAULT_SAMPLE,
+                "scheduler": DEFAULT_SCHEDULER,
+                "batch_size": 1,
+                "n_iter": 1,
+                "enable_hr": False,
+                "hr_upscaler": "Latent",
+                "seed": -1,
+                "send_images": True,
+                "save_images": False,
+                "override_settings": {
+                    "sd_model_checkpoint": DEFAULT_MODEL
+                }
+            }
+            try:
+                response = session.post(
+                    url,
+                    json=payload,
+                    headers={"Content-Type": "application/json"},
+                    timeout=30
+                )
+                response.raise_for_status()
+                data = response.json()
 
-        with open(filepath, "wb") as f:
-            f.write(image_data)
+                images = data.get("images", [])
+                if not images:
+                    log.warning("No image generated for the request : '%s'", query)
+                    continue
 
-        return _public_url(folder_path, filename)
+                results[query] = base64.b64decode(images[0])
 
-    except requests.exceptions.Timeout:
-        log.error(f"Timeout during generation for : '{query}'")
-    except requests.exceptions.RequestException as e:
-        log.error(f"Network error : {e}")
-    except Exception as e:
-        log.error(f"Unexpected error : {e}")
+            except requests.exceptions.Timeout:
+                log.error("Timeout during generation for : '%s'", query)
+            except requests.exceptions.RequestException as e:
+                log.error("Network error : %s", e)
+            except Exception as e:
+                log.error("Unexpected error : %s", e)
 
-    return None
+    return results
 
 def search_unsplash(query):
     api_key = os.getenv("UNSPLASH_ACCESS_KEY")
@@ -147,24 +229,24 @@ def search_unsplash(query):
         "orientation": "landscape"
     }
     headers = {"Authorization": f"Client-ID {api_key}"}
-    log.debug(f"Searching Unsplash for query: '{query}'")
+    log.debug("Searching Unsplash for query: '%s'", query)
     try:
         response = requests.get(url, params=params, headers=headers)
-        log.debug(f"Unsplash API response status: {response.status_code}")
+        log.debug("Unsplash API response status: %s", response.status_code)
         response.raise_for_status() 
         data = response.json()
         if data.get("results"):
             image_url = data["results"][0]["urls"]["regular"]
-            log.debug(f"Found image URL for '{query}': {image_url}")
+            log.debug("Found image URL for '%s': %s", query, image_url)
             return image_url
         else:
-            log.debug(f"No results found on Unsplash for query: '{query}'")
+            log.debug("No results found on Unsplash for query: '%s'", query)
     except requests.exceptions.RequestException as e:
-        log.error(f"Network error while searching image for '{query}': {e}")
+        log.error("Network error while searching image for '%s': %s", query, e)
     except json.JSONDecodeError as e:
-        log.error(f"Error decoding JSON from Unsplash for '{query}': {e}")
+        log.error("Error decoding JSON from Unsplash for '%s': %s", query, e)
     except Exception as e:
-        log.error(f"Unexpected error searching image for '{query}': {e}")
+        log.error("Unexpected error searching image for '%s': %s", query, e)
     return None
 
 def _resolve_log_level(val: str | None) -> int:
@@ -178,38 +260,498 @@ def _resolve_log_level(val: str | None) -> int:
             return logging.INFO
     return getattr(logging, v.upper(), logging.INFO)
 
+_request_id = contextvars.ContextVar("request_id", default="-")
+_caller_id = contextvars.ContextVar("caller_id", default="default")
+
+class _RequestContextFilter(logging.Filter):
+    """Expose the current tool call's request id as %(request_id)s."""
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+class _JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, used when LOG_FORMAT=json."""
+    _EXTRA_FIELDS = ("phase", "duration_ms")
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for field in self._EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
 logging.basicConfig(
     level=_resolve_log_level(LOG_LEVEL_ENV),
-    format=LOG_FORMAT_ENV,
+    format=LOG_FORMAT_ENV if LOG_FORMAT_ENV.lower() != "json" else None,
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(_RequestContextFilter())
+    if LOG_FORMAT_ENV.lower() == "json":
+        _handler.setFormatter(_JsonLogFormatter())
 log = logging.getLogger("file_export_mcp")
 log.setLevel(_resolve_log_level(LOG_LEVEL_ENV))
 log.info("Effective LOG_LEVEL -> %s", logging.getLevelName(log.level))
 
+def _current_caller() -> str:
+    """Best-effort identity of the MCP client, used for per-caller quotas."""
+    try:
+        ctx = mcp.get_context()
+        if ctx.client_id:
+            return str(ctx.client_id)
+        request = getattr(ctx.request_context, "request", None)
+        user_id = request.headers.get("x-openwebui-user-id") if request is not None else None
+        if user_id:
+            return user_id
+    except Exception:
+        pass
+    return "default"
+
+def _with_request_id(func):
+    """Tag every log record emitted during a tool call with a fresh request id."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _request_id.set(uuid.uuid4().hex[:12])
+        caller_token = _caller_id.set(_current_caller())
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            log.info("%s finished in %.1f ms", func.__name__, duration_ms,
+                     extra={"phase": func.__name__, "duration_ms": round(duration_ms, 3)})
+            _caller_id.reset(caller_token)
+            _request_id.reset(token)
+    return wrapper
+
+@contextlib.contextmanager
+def _log_phase(phase: str):
+    if not log.isEnabledFor(logging.DEBUG):
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        log.debug("Phase %s finished in %.1f ms", phase, duration_ms,
+                  extra={"phase": phase, "duration_ms": round(duration_ms, 3)})
+
 mcp = FastMCP("file_export")
 
-def dynamic_font_size(content_list, max_chars=400, base_size=28, min_size=12):
-    total_chars = sum(len(line) for line in content_list)
-    ratio = total_chars / max_chars if max_chars > 0 else 1
-    if ratio <= 1:
-        return Pt(base_size)
-    else:
-        new_size = int(base_size / ratio)
-        return Pt(max(min_size, new_size))
+def _folder_files(folder_path: str):
+    """Yield (path, key) for every file of an export, keys being '<folder>/<relative path>'."""
+    folder = os.path.basename(folder_path)
+    for root, _, names in os.walk(folder_path):
+        for name in names:
+            path = os.path.join(root, name)
+            yield path, f"{folder}/{os.path.relpath(path, folder_path).replace(os.sep, '/')}"
+
+class LocalStorage:
+    """Exports stay in EXPORT_DIR, where the tools write them and the file server reads them."""
+
+    root = EXPORT_DIR
+    # Links go through the file server, which checks FILE_EXPORT_SIGNING_KEY signatures.
+    signed_links = True
+
+    def url(self, folder: str, name: str) -> str:
+        return f"{BASE_URL}/{folder}/{name}"
+
+    def publish(self, folder_path: str):
+        pass
+
+    def delete(self, folder_path: str):
+        pass
+
+class S3Storage(LocalStorage):
+    """Uploads exports to an S3-compatible bucket and drops the local copy."""
+
+    root = EXPORT_STAGING_DIR
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, region: str = None,
+                 public_url: str = "", chunk_size: int = EXPORT_S3_CHUNK_BYTES):
+        if boto3 is None:
+            raise RuntimeError("EXPORT_STORAGE=s3 needs boto3")
+        if not bucket:
+            raise RuntimeError("EXPORT_STORAGE=s3 needs EXPORT_S3_BUCKET")
+        self._client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+        self._bucket = bucket
+        self._prefix = prefix
+        self._public_url = public_url
+        # Nothing in front of a public bucket or CDN would check a signature.
+        self.signed_links = not public_url
+        self._transfer = TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size)
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}/{key}" if self._prefix else key
+
+    def url(self, folder: str, name: str) -> str:
+        if self._public_url:
+            return f"{self._public_url}/{self._key(f'{folder}/{name}')}"
+        return super().url(folder, name)
 
+    def publish(self, folder_path: str):
+        for path, key in _folder_files(folder_path):
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            self._client.upload_file(
+                path, self._bucket, self._key(key),
+                ExtraArgs={"ContentType": content_type}, Config=self._transfer,
+            )
+        shutil.rmtree(folder_path, ignore_errors=True)
 
-def _public_url(folder_path: str, filename: str) -> str:
-    """Build a stable public URL for a generated file."""
+    def delete(self, folder_path: str):
+        prefix = self._key(os.path.basename(folder_path) + "/")
+        for page in self._client.get_paginator("list_objects_v2").paginate(Bucket=self._bucket, Prefix=prefix):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self._client.delete_objects(Bucket=self._bucket, Delete={"Objects": objects, "Quiet": True})
+
+def _make_storage():
+    if EXPORT_STORAGE == "s3":
+        return S3Storage(EXPORT_S3_BUCKET, EXPORT_S3_PREFIX, EXPORT_S3_ENDPOINT_URL, EXPORT_S3_REGION, EXPORT_S3_PUBLIC_URL)
+    if EXPORT_STORAGE != "local":
+        log.warning("Unknown EXPORT_STORAGE '%s', using local storage", EXPORT_STORAGE)
+    return LocalStorage()
+
+storage = _make_storage()
+
+def _export_links(folder_path: str, expires: float = None) -> tuple[int, dict]:
+    """Expiry and file sizes of an export, taken before publishing so its URLs can still be signed."""
+    sizes = {key.split("/", 1)[1]: os.path.getsize(path) for path, key in _folder_files(folder_path)}
+    return int(expires or 0), sizes
+
+def _url_signature(folder: str, name: str, expires: int, size: int) -> str:
+    """HMAC-SHA256 of '<folder>/<name>:<expires>:<size>', as the file server recomputes it."""
+    message = f"{folder}/{name}:{expires}:{size}".encode()
+    digest = hmac.new(SIGNING_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def _public_url(folder_path: str, filename: str, links: tuple[int, dict] = None) -> str:
+    """Build a public URL for a generated file, signed with its expiry and size when the file server serves it."""
     folder = os.path.basename(folder_path).lstrip("/")
     name = filename.lstrip("/")
-    return f"{BASE_URL}/{folder}/{name}"
+    url = storage.url(folder, name)
+    if not SIGNING_KEY or not storage.signed_links:
+        return url
+    expires, sizes = links or (0, {})
+    size = sizes.get(name)
+    if size is None:
+        path = os.path.join(folder_path, name)
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+    sig = _url_signature(folder, name, expires, size)
+    return f"{url}?expires={expires}&size={size}&sig={sig}"
+
+_EXPORT_FOLDER_RE = re.compile(r"^export_(?P<prefix>[0-9a-f]{2})[0-9a-f]*_(?P<date>\d{8})_\d{6}$")
+
+def _export_folder_path(folder_name: str) -> str:
+    """Map a public export folder name to its location on disk (sharded when EXPORT_SHARDING is on)."""
+    if EXPORT_SHARDING:
+        match = _EXPORT_FOLDER_RE.match(folder_name)
+        if match:
+            return os.path.join(storage.root, match.group("date"), match.group("prefix"), folder_name)
+    return os.path.join(storage.root, folder_name)
 
 def _generate_unique_folder() -> str:
+    _enforce_quota(_caller_id.get(), reserve=1)
     folder_name = f"export_{uuid.uuid4().hex[:10]}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    folder_path = os.path.join(EXPORT_DIR, folder_name)
+    folder_path = _export_folder_path(folder_name)
     os.makedirs(folder_path, exist_ok=True)
     return folder_path
 
+@contextlib.contextmanager
+def _export_index():
+    conn = sqlite3.connect(EXPORT_INDEX_PATH, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _init_export_index():
+    with _export_index() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "folder TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, expires REAL, persistent INTEGER NOT NULL, "
+            "caller TEXT NOT NULL DEFAULT 'default')"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(artifacts)")}
+        if "caller" not in columns:
+            conn.execute("ALTER TABLE artifacts ADD COLUMN caller TEXT NOT NULL DEFAULT 'default'")
+        conn.execute("CREATE INDEX IF NOT EXISTS artifacts_expires ON artifacts (expires)")
+        conn.execute("CREATE INDEX IF NOT EXISTS artifacts_created ON artifacts (created)")
+        conn.execute("CREATE INDEX IF NOT EXISTS artifacts_caller_created ON artifacts (caller, created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS artifact_blobs (folder TEXT NOT NULL, digest TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS artifact_blobs_folder ON artifact_blobs (folder)")
+        rows = conn.execute("SELECT caller, COALESCE(SUM(size), 0) FROM artifacts GROUP BY caller").fetchall()
+    with _usage_lock:
+        _usage_by_caller.clear()
+        _usage_by_caller.update(dict(rows))
+
+def _folder_size(folder_path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(folder_path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _register_export(folder_path: str, persistent: bool):
+    now = time.time()
+    expires = None if persistent else now + FILES_DELAY * 60
+    caller = _caller_id.get()
+    size = _folder_size(folder_path)
+    try:
+        with _export_index() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (folder, path, size, created, expires, persistent, caller) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.basename(folder_path), folder_path, size, now, expires, int(bool(persistent)), caller),
+            )
+    except sqlite3.Error as e:
+        log.warning("Could not index export %s: %s", folder_path, e)
+        return expires
+    _track_usage(caller, size)
+    return expires
+
+def _unregister_export(folder_path: str):
+    try:
+        with _export_index() as conn:
+            row = conn.execute(
+                "SELECT caller, size FROM artifacts WHERE folder = ?", (os.path.basename(folder_path),)
+            ).fetchone()
+            conn.execute("DELETE FROM artifacts WHERE folder = ?", (os.path.basename(folder_path),))
+    except sqlite3.Error as e:
+        log.warning("Could not remove export %s from the index: %s", folder_path, e)
+        return
+    if row:
+        _track_usage(row[0], -row[1])
+
+class ExportQuotaExceeded(RuntimeError):
+    """Raised when FILE_EXPORT_DIR has no room left for a new export."""
+
+_usage_lock = threading.Lock()
+_usage_by_caller = {}
+
+def _track_usage(caller: str, delta: int):
+    with _usage_lock:
+        _usage_by_caller[caller] = _usage_by_caller.get(caller, 0) + delta
+
+def _quota_overrun(caller: str, reserve: int = 0):
+    """Return (scope, used, quota) for the first exceeded budget, or None."""
+    with _usage_lock:
+        total = sum(_usage_by_caller.values())
+        used_by_caller = _usage_by_caller.get(caller, 0)
+    if EXPORT_QUOTA_BYTES and total + reserve > EXPORT_QUOTA_BYTES:
+        return "global", total, EXPORT_QUOTA_BYTES
+    if EXPORT_CALLER_QUOTA_BYTES and used_by_caller + reserve > EXPORT_CALLER_QUOTA_BYTES:
+        return "caller", used_by_caller, EXPORT_CALLER_QUOTA_BYTES
+    return None
+
+def _evict_oldest_export(caller: str = None, exclude: str = None) -> bool:
+    query = "SELECT path FROM artifacts WHERE persistent = 0"
+    params = []
+    if caller is not None:
+        query += " AND caller = ?"
+        params.append(caller)
+    if exclude is not None:
+        query += " AND folder != ?"
+        params.append(os.path.basename(exclude))
+    with _export_index() as conn:
+        row = conn.execute(query + " ORDER BY created LIMIT 1", params).fetchone()
+    if row is None:
+        return False
+    log.info("Evicting export %s to stay within quota", row[0])
+    _remove_export_folder(row[0])
+    return True
+
+def _enforce_quota(caller: str, reserve: int = 0, exclude: str = None):
+    """Evict the oldest non-persistent exports until the budgets hold, or fail fast."""
+    if not (EXPORT_QUOTA_BYTES or EXPORT_CALLER_QUOTA_BYTES):
+        return
+    while True:
+        overrun = _quota_overrun(caller, reserve)
+        if overrun is None:
+            return
+        scope, used, quota = overrun
+        try:
+            evicted = _evict_oldest_export(caller if scope == "caller" else None, exclude)
+        except sqlite3.Error as e:
+            log.warning("Could not evict exports: %s", e)
+            evicted = False
+        if not evicted:
+            who = "this caller" if scope == "caller" else "the export directory"
+            raise ExportQuotaExceeded(
+                f"Export quota exhausted: {used} of {quota} bytes used by {who} and only persistent "
+                f"exports remain. Delete persistent exports or raise the quota."
+            )
+
+_blob_lock = threading.Lock()
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(EXPORT_BLOB_DIR, digest[:2], digest)
+
+def _file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _link_blob(blob_path: str, path: str):
+    """Atomically replace path with a hard link to blob_path, or a relative symlink without hard links."""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.link(blob_path, tmp)
+    except OSError:
+        os.symlink(os.path.relpath(blob_path, os.path.dirname(path)), tmp)
+    os.replace(tmp, path)
+
+def _store_blob(path: str, digest: str) -> bool:
+    """Make path an alias of the blob holding its bytes, creating the blob from it if needed."""
+    blob_path = _blob_path(digest)
+    if os.path.isfile(blob_path):
+        try:
+            _link_blob(blob_path, path)
+            return True
+        except OSError as e:
+            log.debug("Cannot link %s into the blob store: %s", path, e)
+            return False
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    try:
+        os.link(path, blob_path)
+        return True
+    except OSError:
+        pass
+    os.replace(path, blob_path)
+    try:
+        _link_blob(blob_path, path)
+        return True
+    except OSError as e:
+        os.replace(blob_path, path)
+        log.debug("Cannot link %s into the blob store: %s", path, e)
+        return False
+
+def _dedupe_export(folder_path: str):
+    """Store the export's files once by SHA-256 under EXPORT_DIR/.blobs."""
+    files = []
+    for root, _, names in os.walk(folder_path):
+        for name in names:
+            path = os.path.join(root, name)
+            if not os.path.islink(path) and os.path.getsize(path):
+                files.append((path, os.path.getsize(path), _file_digest(path)))
+    if not files:
+        return
+    folder = os.path.basename(folder_path)
+    with _blob_lock:
+        stored = [(size, digest) for path, size, digest in files if _store_blob(path, digest)]
+        try:
+            with _export_index() as conn:
+                conn.executemany(
+                    "INSERT INTO blobs (digest, size, refs) VALUES (?, ?, 1) "
+                    "ON CONFLICT(digest) DO UPDATE SET refs = refs + 1",
+                    [(digest, size) for size, digest in stored],
+                )
+                conn.executemany(
+                    "INSERT INTO artifact_blobs (folder, digest) VALUES (?, ?)",
+                    [(folder, digest) for _, digest in stored],
+                )
+        except sqlite3.Error as e:
+            log.warning("Could not record blobs of %s: %s", folder_path, e)
+    log.debug("Deduplicated %s of %s files of %s", len(stored), len(files), folder_path)
+
+def _release_blobs(folder_path: str):
+    """Drop the export's blob references and delete the blobs nothing uses any more."""
+    folder = os.path.basename(folder_path)
+    with _blob_lock:
+        try:
+            with _export_index() as conn:
+                digests = [row[0] for row in conn.execute(
+                    "SELECT digest FROM artifact_blobs WHERE folder = ?", (folder,)
+                )]
+                if not digests:
+                    return
+                conn.execute("DELETE FROM artifact_blobs WHERE folder = ?", (folder,))
+                conn.executemany("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", [(d,) for d in digests])
+                orphans = [row[0] for row in conn.execute("SELECT digest FROM blobs WHERE refs <= 0")]
+                conn.execute("DELETE FROM blobs WHERE refs <= 0")
+        except sqlite3.Error as e:
+            log.warning("Could not release blobs of %s: %s", folder_path, e)
+            return
+        for digest in orphans:
+            blob_path = _blob_path(digest)
+            try:
+                os.remove(blob_path)
+                # Only succeeds once the .blobs/<xx> prefix directory is empty.
+                os.rmdir(os.path.dirname(blob_path))
+            except OSError:
+                pass
+
+def _purge_orphan_blobs() -> int:
+    """Delete blob files the index does not reference, e.g. after a crash mid-export."""
+    if not os.path.isdir(EXPORT_BLOB_DIR):
+        return 0
+    with _export_index() as conn:
+        known = {row[0] for row in conn.execute("SELECT digest FROM blobs WHERE refs > 0")}
+    removed = 0
+    with _blob_lock:
+        for root, _, names in os.walk(EXPORT_BLOB_DIR):
+            for name in names:
+                if name not in known:
+                    try:
+                        os.remove(os.path.join(root, name))
+                        removed += 1
+                    except OSError:
+                        pass
+    return removed
+
+def _remove_export_folder(folder_path: str):
+    shutil.rmtree(folder_path, ignore_errors=True)
+    try:
+        storage.delete(folder_path)
+    except Exception as e:
+        log.warning("Could not delete %s from %s storage: %s", folder_path, EXPORT_STORAGE, e)
+    _release_blobs(folder_path)
+    _unregister_export(folder_path)
+    parent = os.path.dirname(folder_path)
+    while os.path.abspath(parent) != os.path.abspath(storage.root):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+def _purge_expired_exports(now: float = None) -> int:
+    """Delete non-persistent exports whose delay has elapsed, e.g. after a restart."""
+    now = time.time() if now is None else now
+    with _export_index() as conn:
+        rows = conn.execute(
+            "SELECT path FROM artifacts WHERE expires IS NOT NULL AND expires <= ?", (now,)
+        ).fetchall()
+    for (path,) in rows:
+        _remove_export_folder(path)
+    return len(rows)
+
+def _export_stats() -> dict:
+    with _export_index() as conn:
+        count, size, persistent = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(persistent), 0) FROM artifacts"
+        ).fetchone()
+    return {"count": count, "size": size, "persistent": persistent}
+
 def _generate_filename(folder_path: str, ext: str, filename: str = None) -> tuple[str, str]:
     if not filename:
         filename = f"export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
@@ -222,6 +764,135 @@ def _generate_filename(folder_path: str, ext: str, filename: str = None) -> tupl
         counter += 1
     return filepath, filename
 
+class _RegistryImage(ReportLabImage):
+    """ReportLab Image flowable drawing from an already decoded ImageReader."""
+    def __init__(self, reader, width=None, height=None):
+        self._img = reader
+        super().__init__(BytesIO(), width=width, height=height)
+
+def _is_image_url(src: str) -> bool:
+    return bool(src) and src.startswith(("http://", "https://"))
+
+class ImageRegistry:
+    """Per-document image cache: each source is fetched and each distinct image decoded once."""
+    def __init__(self):
+        self._urls = {}
+        self._sources = {}
+        self._blobs = {}
+        self._readers = {}
+        self._failed = {}
+
+    def prefetch(self, queries: list[str]):
+        """Resolve all pending image queries of a document in one pass."""
+        pending = [q for q in dict.fromkeys(q.strip() for q in queries if q and q.strip()) if q not in self._urls]
+        if not pending:
+            return
+        if os.getenv("IMAGE_SOURCE", "unsplash") == "local_sd":
+            generated = generate_local_sd_images(pending)
+            for query in pending:
+                data = generated.get(query)
+                self._urls[query] = self._store(data) if data is not None else None
+        else:
+            for query in pending:
+                self._urls[query] = search_image(query)
+
+    def url_for_query(self, query: str):
+        query = query.strip()
+        if query not in self._urls:
+            self.prefetch([query])
+        else:
+            log.debug("Image query already resolved: '%s'", query)
+        return self._urls[query]
+
+    def has(self, src: str) -> bool:
+        return src in self._sources
+
+    def _store(self, data: bytes, src: str = None) -> str:
+        digest = hashlib.sha1(data).hexdigest()
+        self._blobs.setdefault(digest, data)
+        src = src or f"local_sd:{digest}"
+        self._sources[src] = digest
+        return src
+
+    def _digest(self, src: str) -> str:
+        digest = self._sources.get(src)
+        if digest is not None:
+            log.debug("Image already fetched for this document: %s", src)
+            return digest
+        error = self._failed.get(src)
+        if error is not None:
+            log.debug("Image already failed for this document: %s", src)
+            raise error
+        try:
+            if not _is_image_url(src):
+                # Only URLs and generated local_sd images; never files from the server's disk.
+                raise ValueError(f"Not an http(s) image URL: {src}")
+            log.debug("Downloading image: %s", src)
+            response = requests.get(src)
+            response.raise_for_status()
+            data = response.content
+        except Exception as e:
+            self._failed[src] = e
+            raise
+        return self._sources[self._store(data, src)]
+
+    def generated_images(self) -> dict[str, bytes]:
+        """Bytes of the local_sd images, which exist nowhere but in this registry."""
+        return {src: self._blobs[digest] for src, digest in self._sources.items() if src.startswith("local_sd:")}
+
+    def get_bytes(self, src: str) -> bytes:
+        return self._blobs[self._digest(src)]
+
+    def stream(self, src: str) -> BytesIO:
+        return BytesIO(self.get_bytes(src))
+
+    def flowable(self, src: str, width=None, height=None) -> ReportLabImage:
+        digest = self._digest(src)
+        reader = self._readers.get(digest)
+        if reader is None:
+            reader = self._readers[digest] = ImageReader(BytesIO(self._blobs[digest]))
+        return _RegistryImage(reader, width=width, height=height)
+
+class FontManager:
+    """Registers TrueType fonts with ReportLab once per process."""
+
+    def __init__(self):
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    def register(self, path: str, name: str = None) -> str:
+        """Register the font at path and return its ReportLab font name."""
+        return self.font(path, name).fontName
+
+    def font(self, path: str, name: str = None) -> TTFont:
+        path = os.path.abspath(path)
+        with self._lock:
+            font = self._fonts.get(path)
+            if font is None:
+                name = name or os.path.splitext(os.path.basename(path))[0]
+                font = TTFont(name, path)
+                pdfmetrics.registerFont(font)
+                self._fonts[path] = font
+                log.debug("Registered font %s from %s", font.fontName, path)
+            return font
+
+    def register_family(self, regular: str, bold: str = None, italic: str = None, bold_italic: str = None) -> dict:
+        """Register a family so <b>/<i> markup maps to its faces; missing faces reuse regular."""
+        normal = self.register(regular)
+        bold_name = self.register(bold) if bold else normal
+        italic_name = self.register(italic) if italic else normal
+        bold_italic_name = self.register(bold_italic) if bold_italic else bold_name
+        pdfmetrics.registerFontFamily(
+            normal, normal=normal, bold=bold_name, italic=italic_name, boldItalic=bold_italic_name
+        )
+        return {"normal": normal, "bold": bold_name, "italic": italic_name, "boldItalic": bold_italic_name}
+
+fonts = FontManager()
+
+@functools.lru_cache(maxsize=8192)
+def _string_width(text: str, font_name: str, size: float) -> float:
+    return stringWidth(text, font_name, size)
+
 styles = getSampleStyleSheet()
 styles.add(ParagraphStyle(
     name="CustomHeading1",
@@ -278,17 +949,153 @@ styles.add(ParagraphStyle(
     topPadding=5,
     bottomPadding=5
 ))
+styles.add(ParagraphStyle(
+    name="CustomTableCell",
+    parent=styles["Normal"],
+    fontSize=9,
+    leading=11,
+    alignment=TA_LEFT
+))
+styles.add(ParagraphStyle(
+    name="CustomTableHeader",
+    parent=styles["CustomTableCell"],
+    fontName="Helvetica-Bold",
+    textColor=colors.white
+))
+
+PDF_BODY_FONT = "Helvetica"
+PDF_BOLD_FONT = "Helvetica-Bold"
+PDF_CODE_FONT = "Courier"
+
+def _configure_pdf_fonts():
+    """Switch the custom styles to PDF_FONT / PDF_FONT_MONO when they are configured."""
+    global PDF_BODY_FONT, PDF_BOLD_FONT, PDF_CODE_FONT
+    if PDF_FONT:
+        try:
+            family = fonts.register_family(PDF_FONT, PDF_FONT_BOLD, PDF_FONT_ITALIC, PDF_FONT_BOLD_ITALIC)
+        except Exception as e:
+            log.warning("Could not register PDF font %s, keeping Helvetica: %s", PDF_FONT, e)
+        else:
+            PDF_BODY_FONT, PDF_BOLD_FONT = family["normal"], family["bold"]
+            for name in ("CustomNormal", "CustomListItem", "CustomTableCell"):
+                styles[name].fontName = PDF_BODY_FONT
+            for name in ("CustomHeading1", "CustomHeading2", "CustomHeading3", "CustomTableHeader"):
+                styles[name].fontName = PDF_BOLD_FONT
+    if PDF_FONT_MONO:
+        try:
+            PDF_CODE_FONT = fonts.register(PDF_FONT_MONO)
+        except Exception as e:
+            log.warning("Could not register PDF mono font %s, keeping Courier: %s", PDF_FONT_MONO, e)
+        else:
+            styles["CustomCode"].fontName = PDF_CODE_FONT
+
+_configure_pdf_fonts()
+
+_PARAGRAPH_CACHE_SIZE = 2048
+_paragraph_cache = collections.OrderedDict()
+_paragraph_lock = threading.Lock()
+
+def _paragraph(text: str, style: ParagraphStyle) -> Paragraph:
+    """Paragraph(text, style) that parses each (text, style) markup only once."""
+    key = (text, style.name)
+    with _paragraph_lock:
+        template = _paragraph_cache.get(key)
+        if template is not None:
+            _paragraph_cache.move_to_end(key)
+    if template is None:
+        try:
+            template = Paragraph(text, style)
+        except ValueError as e:
+            # Unbalanced tags or bad attributes: keep the words, drop the markup.
+            log.warning("Invalid paragraph markup, rendering it as plain text: %s", e)
+            template = Paragraph(html.escape(html.unescape(_HTML_TAG_RE.sub("", text)), quote=False), style)
+        with _paragraph_lock:
+            _paragraph_cache[key] = template
+            if len(_paragraph_cache) > _PARAGRAPH_CACHE_SIZE:
+                _paragraph_cache.popitem(last=False)
+    return copy.copy(template)
+
+_EMOJI_ALIAS_RE = re.compile(r":[^:\s]+:")
+_EMOJI_VARIATION_RE = re.compile("[\ufe0e\ufe0f]")
+
+@functools.lru_cache(maxsize=1)
+def _emoji_alias_table() -> dict[str, str]:
+    """Map every :alias: and :english_name: to its emoji, as emojize(language="alias") does."""
+    fully_qualified = emoji.STATUS["fully_qualified"]
+    table = {}
+    for emj, data in emoji.EMOJI_DATA.items():
+        if data["status"] > fully_qualified:
+            continue
+        table.setdefault(data["en"], emj)
+    for emj, data in emoji.EMOJI_DATA.items():
+        if data["status"] > fully_qualified:
+            continue
+        for alias in data.get("alias", ()):
+            table[alias] = emj
+    return table
+
+def _register_emoji_font():
+    """Register PDF_EMOJI_FONT and return (font name, emoji chars it can draw, run regex)."""
+    if not PDF_EMOJI_FONT or not os.path.isfile(PDF_EMOJI_FONT):
+        log.debug("No emoji fallback font found at %s", PDF_EMOJI_FONT)
+        return None, frozenset(), None
+    try:
+        font = fonts.font(PDF_EMOJI_FONT, "EmojiFallback")
+    except Exception as e:
+        log.warning("Could not register emoji font %s: %s", PDF_EMOJI_FONT, e)
+        return None, frozenset(), None
+    glyphs = font.face.charToGlyph
+    chars = frozenset(
+        c for emj in emoji.EMOJI_DATA for c in emj if ord(c) > 0x7f and ord(c) in glyphs
+    ) - {"\ufe0e", "\ufe0f", "\u200d"}
+    char_class = "".join(re.escape(c) for c in sorted(chars))
+    return font.fontName, chars, re.compile(f"[{char_class}]+")
+
+EMOJI_FONT_NAME, _EMOJI_CHARS, _EMOJI_RUN_RE = _register_emoji_font()
+
+def replace_emoji_aliases(text: str) -> str:
+    """Replace :alias: codes with their emoji characters."""
+    if ":" not in text:
+        return text
+    table = _emoji_alias_table()
+    return _EMOJI_ALIAS_RE.sub(lambda m: table.get(m.group(0), m.group(0)), text)
+
+@functools.lru_cache(maxsize=4096)
+def _emojize(text: str) -> str:
+    text = replace_emoji_aliases(text)
+    if not text.isascii() and not _EMOJI_CHARS.isdisjoint(text):
+        text = _EMOJI_VARIATION_RE.sub("", text)
+        text = _EMOJI_RUN_RE.sub(lambda m: f'<font name="{EMOJI_FONT_NAME}">{m.group(0)}</font>', text)
+    return text
+
+_MARKUP_RE = re.compile(
+    r"(</?(?:b|i|u|a|font|br)\b[^<>]*>|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);)|[<>&]"
+)
+_MARKUP_ESCAPES = {"<": "&lt;", ">": "&gt;", "&": "&amp;"}
+
+def sanitize_markup(text: str) -> str:
+    """Escape text for Paragraph, keeping entities and the b/i/u/a/font/br inline tags."""
+    if "<" not in text and ">" not in text and "&" not in text:
+        return text
+    return _MARKUP_RE.sub(lambda m: m.group(1) or _MARKUP_ESCAPES[m.group(0)], text)
 
 def render_text_with_emojis(text: str) -> str:
+    """Sanitize text into Paragraph markup and switch emoji runs to the fallback font."""
     if not text:
         return ""
+    text = sanitize_markup(text)
+    if text.isascii() and ":" not in text:
+        return text
     try:
-        converted = emoji.emojize(text, language="alias")
-        return converted
+        return _emojize(text)
     except Exception as e:
-        log.error(f"Error in emoji conversion: {e}")
+        log.error("Error in emoji conversion: %s", e)
         return text
 
+def _plain_text_markup(text: str) -> str:
+    """Escape plain text (no markup of its own) into Paragraph markup with emoji runs."""
+    return render_text_with_emojis(html.escape(text, quote=False))
+
 def process_list_items(ul_or_ol_element, is_ordered=False):
     items = []
     bullet_type = '1' if is_ordered else 'bullet'
@@ -302,8 +1109,8 @@ def process_list_items(ul_or_ol_element, is_ordered=False):
         li_text = ''.join(li_text_parts).strip()
         list_item_paragraph = None
         if li_text:
-            rendered_text = render_text_with_emojis(li_text)
-            list_item_paragraph = Paragraph(rendered_text, styles["CustomListItem"])
+            rendered_text = _plain_text_markup(li_text)
+            list_item_paragraph = _paragraph(rendered_text, styles["CustomListItem"])
         sub_lists = li.find_all(['ul', 'ol'], recursive=False)
         sub_flowables = []
         if list_item_paragraph:
@@ -325,36 +1132,97 @@ def process_list_items(ul_or_ol_element, is_ordered=False):
             items.append(ListItem(sub_flowables))
     return items
 
-def render_html_elements(soup):
+def _append_image(story, src, alt, images: ImageRegistry, trace: bool = False):
+    if src is not None:
+        try:
+            if src.startswith("image_query:"):
+                query = src.replace("image_query:", "").strip()
+                if trace:
+                    log.debug("Handling image_query: '%s'", query)
+                image_url = images.url_for_query(query)
+                if image_url:
+                    if trace:
+                        log.debug("Loading image from Unsplash URL: %s", image_url)
+                    img = images.flowable(image_url, width=200, height=150)
+                    if trace:
+                        log.debug("Adding ReportLab Image object to story (Unsplash)")
+                    story.append(img)
+                    story.append(Spacer(1, 10))
+                else:
+                    log.warning("No image found for query: %s", query)
+                    story.append(Paragraph(html.escape(f"[Image non trouvee pour: {query}]", quote=False), styles["CustomNormal"]))
+                    story.append(Spacer(1, 6))
+            elif _is_image_url(src) or images.has(src):
+                if trace:
+                    log.debug("Loading image from direct URL: %s", src)
+                img = images.flowable(src, width=200, height=150)
+                if trace:
+                    log.debug("Adding ReportLab Image object to story (Direct URL)")
+                story.append(img)
+                story.append(Spacer(1, 10))
+            else:
+                log.warning("Refusing local image path: %s", src)
+                story.append(Paragraph(html.escape(f"[Image: {alt}]", quote=False), styles["CustomNormal"]))
+                story.append(Spacer(1, 6))
+        except requests.exceptions.RequestException as e:
+            log.error("Network error loading image %s: %s", src, e)
+            story.append(Paragraph(html.escape(f"[Image (network error): {alt}]", quote=False), styles["CustomNormal"]))
+            story.append(Spacer(1, 6))
+        except Exception as e:
+            log.error("Error processing image %s: %s", src, e, exc_info=True)
+            story.append(Paragraph(html.escape(f"[Image: {alt}]", quote=False), styles["CustomNormal"]))
+            story.append(Spacer(1, 6))
+    else:
+        log.warning("Image tag found with no 'src' attribute.")
+        story.append(Paragraph(html.escape(f"[Image: {alt} (source manquante)]", quote=False), styles["CustomNormal"]))
+        story.append(Spacer(1, 6))
+
+def render_html_elements(soup, images: ImageRegistry = None):
     log.debug("Starting render_html_elements...")
-    story = []
+    story = list(iter_html_elements(soup, images))
+    log.debug("Finished render_html_elements. Story contains %s elements.", len(story))
+    return story
+
+def iter_html_elements(soup, images: ImageRegistry = None):
+    """Yield the story for soup one top-level element at a time."""
+    if images is None:
+        images = ImageRegistry()
     element_count = 0
+    debug = log.isEnabledFor(logging.DEBUG)
     for elem in soup.children:
+        story = []
         element_count += 1
-        log.debug(f"Processing element #{element_count}: {type(elem)}, name={getattr(elem, 'name', 'NavigableString')}")
+        trace = debug and element_count % LOG_ELEMENT_SAMPLING == 0
+        if trace:
+            log.debug("Processing element #%s: %s, name=%s", element_count, type(elem), getattr(elem, 'name', 'NavigableString'))
         if isinstance(elem, NavigableString):
             text = str(elem).strip()
             if text:
-                log.debug(f"Adding Paragraph from NavigableString: {text[:50]}...")
-                story.append(Paragraph(render_text_with_emojis(text), styles["CustomNormal"]))
+                if trace:
+                    log.debug("Adding Paragraph from NavigableString: %.50s...", text)
+                story.append(_paragraph(_plain_text_markup(text), styles["CustomNormal"]))
                 story.append(Spacer(1, 6))
         elif hasattr(elem, 'name'):
             tag_name = elem.name
-            log.debug(f"Handling tag: <{tag_name}>")
+            if trace:
+                log.debug("Handling tag: <%s>", tag_name)
             if tag_name == "h1":
-                text = render_text_with_emojis(elem.get_text().strip())
-                log.debug(f"Adding H1: {text[:50]}...")
-                story.append(Paragraph(text, styles["CustomHeading1"]))
+                text = _plain_text_markup(elem.get_text().strip())
+                if trace:
+                    log.debug("Adding H1: %.50s...", text)
+                story.append(_paragraph(text, styles["CustomHeading1"]))
                 story.append(Spacer(1, 10))
             elif tag_name == "h2":
-                text = render_text_with_emojis(elem.get_text().strip())
-                log.debug(f"Adding H2: {text[:50]}...")
-                story.append(Paragraph(text, styles["CustomHeading2"]))
+                text = _plain_text_markup(elem.get_text().strip())
+                if trace:
+                    log.debug("Adding H2: %.50s...", text)
+                story.append(_paragraph(text, styles["CustomHeading2"]))
                 story.append(Spacer(1, 8))
             elif tag_name == "h3":
-                text = render_text_with_emojis(elem.get_text().strip())
-                log.debug(f"Adding H3: {text[:50]}...")
-                story.append(Paragraph(text, styles["CustomHeading3"]))
+                text = _plain_text_markup(elem.get_text().strip())
+                if trace:
+                    log.debug("Adding H3: %.50s...", text)
+                story.append(_paragraph(text, styles["CustomHeading3"]))
                 story.append(Spacer(1, 6))
             elif tag_name == "p":
                 imgs = elem.find_all("img")
@@ -363,31 +1231,28 @@ def render_html_elements(soup):
                         src = img_tag.get("src")
                         alt = img_tag.get("alt", "[Image]")
                         try:
-                            if src and src.startswith("http"):
-                                response = requests.get(src)
-                                response.raise_for_status()
-                                img_data = BytesIO(response.content)
-                                img = Image(img_data, width=200, height=150)
-                            else:
-                                img = Image(src, width=200, height=150)
+                            img = images.flowable(src, width=200, height=150)
                             story.append(img)
                             story.append(Spacer(1, 10))
                         except Exception as e:
-                            log.error(f"Error loading image {src}: {e}")
-                            story.append(Paragraph(f"[Image: {alt}]", styles["CustomNormal"]))
+                            log.error("Error loading image %s: %s", src, e)
+                            story.append(Paragraph(html.escape(f"[Image: {alt}]", quote=False), styles["CustomNormal"]))
                             story.append(Spacer(1, 6))
                 else:
-                    text = render_text_with_emojis(elem.get_text().strip())
+                    text = _plain_text_markup(elem.get_text().strip())
                     if text:
-                        log.debug(f"Adding Paragraph: {text[:50]}...")
-                        story.append(Paragraph(text, styles["CustomNormal"]))
+                        if trace:
+                            log.debug("Adding Paragraph: %.50s...", text)
+                        story.append(_paragraph(text, styles["CustomNormal"]))
                         story.append(Spacer(1, 6))
             elif tag_name in ["ul", "ol"]:
                 is_ordered = tag_name == "ol"
-                log.debug(f"Processing list (ordered={is_ordered})...")
+                if trace:
+                    log.debug("Processing list (ordered=%s)...", is_ordered)
                 items = process_list_items(elem, is_ordered)
                 if items:
-                    log.debug(f"Adding ListFlowable with {len(items)} items")
+                    if trace:
+                        log.debug("Adding ListFlowable with %s items", len(items))
                     story.append(ListFlowable(items,
                         bulletType='1' if is_ordered else 'bullet',
                         leftIndent=10 * mm,
@@ -396,100 +1261,737 @@ def render_html_elements(soup):
                         spaceAfter=10
                     ))
             elif tag_name == "blockquote":
-                text = render_text_with_emojis(elem.get_text().strip())
+                text = _plain_text_markup(elem.get_text().strip())
                 if text:
-                    log.debug(f"Adding Blockquote: {text[:50]}...")
-                    story.append(Paragraph(f"{text}", styles["CustomNormal"]))
+                    if trace:
+                        log.debug("Adding Blockquote: %.50s...", text)
+                    story.append(_paragraph(f"{text}", styles["CustomNormal"]))
                     story.append(Spacer(1, 8))
-            elif tag_name in ["code", "pre"]:
-                text = elem.get_text().strip()
+            elif tag_name in ["code", "pre"] or (tag_name == "div" and "codehilite" in elem.get("class", [])):
+                text = elem.get_text().strip("\n").rstrip()
                 if text:
-                    log.debug(f"Adding Code/Pre block: {text[:50]}...")
-                    story.append(Paragraph(text, styles["CustomCode"]))
+                    if trace:
+                        log.debug("Adding Code/Pre block: %.50s...", text)
+                    code = elem.find("code") if tag_name != "code" else elem
+                    language = next(
+                        (c[len("language-"):] for c in (code.get("class", []) if code else []) if c.startswith("language-")),
+                        None
+                    )
+                    story.append(_code_flowable(text, language))
                     story.append(Spacer(1, 6 if tag_name == "code" else 8))
             elif tag_name == "img":
                 src = elem.get("src")
                 alt = elem.get("alt", "[Image]")
-                log.debug(f"Found <img> tag. src='{src}', alt='{alt}'")
-                if src is not None: 
-                    try:
-                        if src.startswith("image_query:"):
-
-                            query = src.replace("image_query:", "").strip()
-                            log.debug(f"Handling image_query: '{query}'")
-                            image_url = search_image(query)
-                            if image_url:
-                                log.debug(f"Downloading image from Unsplash URL: {image_url}")
-                                response = requests.get(image_url)
-                                log.debug(f"Image download response status: {response.status_code}")
-                                response.raise_for_status()
-                                img_data = BytesIO(response.content)
-                                img = ReportLabImage(img_data, width=200, height=150)
-                                log.debug("Adding ReportLab Image object to story (Unsplash)")
-                                story.append(img)
-                                story.append(Spacer(1, 10))
-                            else:
-                                log.warning(f"No image found for query: {query}")
-                                story.append(Paragraph(f"[Image non trouvee pour: {query}]", styles["CustomNormal"]))
-                                story.append(Spacer(1, 6))
-                        elif src.startswith("http"):
-                            log.debug(f"Downloading image from direct URL: {src}")
-                            response = requests.get(src)
-                            log.debug(f"Image download response status: {response.status_code}")
-                            response.raise_for_status()
-                            img_data = BytesIO(response.content)
-                            img = ReportLabImage(img_data, width=200, height=150)
-                            log.debug("Adding ReportLab Image object to story (Direct URL)")
-                            story.append(img)
-                            story.append(Spacer(1, 10))
-                        else:
-                            log.debug(f"Loading local image: {src}")
-                            if os.path.exists(src):
-                                img = ReportLabImage(src, width=200, height=150)
-                                log.debug("Adding ReportLab Image object to story (Local)")
-                                story.append(img)
-                                story.append(Spacer(1, 10))
-                            else:
-                               log.error(f"Local image file not found: {src}")
-                               story.append(Paragraph(f"[Image locale non trouvee: {src}]", styles["CustomNormal"]))
-                               story.append(Spacer(1, 6))
-                    except requests.exceptions.RequestException as e:
-                        log.error(f"Network error loading image {src}: {e}")
-                        story.append(Paragraph(f"[Image (network error): {alt}]", styles["CustomNormal"]))
-                        story.append(Spacer(1, 6))
-                    except Exception as e:
-                        log.error(f"Error processing image {src}: {e}", exc_info=True) 
-                        story.append(Paragraph(f"[Image: {alt}]", styles["CustomNormal"]))
-                        story.append(Spacer(1, 6))
-                else:
-                    log.warning("Image tag found with no 'src' attribute.")
-                    story.append(Paragraph(f"[Image: {alt} (source manquante)]", styles["CustomNormal"]))
-                    story.append(Spacer(1, 6))
+                if trace:
+                    log.debug("Found <img> tag. src='%s', alt='%s'", src, alt)
+                _append_image(story, src, alt, images, trace)
+            elif tag_name == "table":
+                rows = []
+                header_rows = 0
+                for tr in elem.find_all("tr"):
+                    cells = tr.find_all(["th", "td"], recursive=False)
+                    if header_rows == len(rows) and cells and all(c.name == "th" for c in cells):
+                        header_rows += 1
+                    rows.append([
+                        _plain_text_markup(c.get_text().strip()) for c in cells
+                    ])
+                if trace:
+                    log.debug("Adding Table with %s rows", len(rows))
+                yield from _table_flowables(rows, header_rows)
             elif tag_name == "br":
-                log.debug("Adding Spacer for <br>")
+                if trace:
+                    log.debug("Adding Spacer for <br>")
                 story.append(Spacer(1, 6))
             else:
                 text = elem.get_text().strip()
                 if text:
-                    log.debug(f"Adding Paragraph for unknown tag <{tag_name}>: {text[:50]}...")
-                    story.append(Paragraph(render_text_with_emojis(text), styles["CustomNormal"]))
+                    if trace:
+                        log.debug("Adding Paragraph for unknown tag <%s>: %.50s...", tag_name, text)
+                    story.append(_paragraph(_plain_text_markup(text), styles["CustomNormal"]))
                     story.append(Spacer(1, 6))
-    log.debug(f"Finished render_html_elements. Story contains {len(story)} elements.")
+        yield from story
+
+_markdown_parser = (
+    MarkdownIt("commonmark", {"breaks": True, "html": True}).enable(["table", "strikethrough"])
+    if MarkdownIt else None
+)
+
+def _parse_markdown(md_text: str) -> list:
+    return _markdown_parser.parse(md_text)
+
+_IMG_TAG_RE = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+_HTML_ATTR_RE = re.compile(r"""([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_BR_TAG_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_HEADING_STYLES = {1: ("CustomHeading1", 10), 2: ("CustomHeading2", 8), 3: ("CustomHeading3", 6)}
+
+PDF_FRAME_WIDTH = A4[0] - 2 * 72
+PDF_TABLE_CHUNK_ROWS = 500
+_TABLE_MIN_COL_WIDTH = 30
+
+def _table_col_widths(natural: list[float], available: float) -> list[float]:
+    """Keep columns that fit an even share at their natural width and split the rest among the wide ones."""
+    if sum(natural) <= available:
+        return list(natural)
+    widths = [None] * len(natural)
+    remaining = available
+    while True:
+        wide = [j for j, w in enumerate(widths) if w is None]
+        share = remaining / len(wide)
+        narrow = [j for j in wide if natural[j] <= share]
+        if not narrow or len(narrow) == len(wide):
+            break
+        for j in narrow:
+            widths[j] = natural[j]
+            remaining -= natural[j]
+    wide_total = sum(natural[j] for j in wide)
+    for j in wide:
+        widths[j] = max(_TABLE_MIN_COL_WIDTH, remaining * natural[j] / wide_total)
+    return widths
+
+def _table_flowables(rows: list[list[str]], header_rows: int = 0):
+    """Lay out table cells (Paragraph markup strings) as one or more LongTables."""
+    if not rows:
+        return
+    ncols = max(len(row) for row in rows)
+    if ncols == 0:
+        return
+    longest = [""] * ncols
+    for row in rows:
+        for j, cell in enumerate(row):
+            if len(cell) > len(longest[j]):
+                longest[j] = cell
+    natural = [
+        max(_TABLE_MIN_COL_WIDTH, _string_width(html.unescape(_HTML_TAG_RE.sub("", cell)), PDF_BODY_FONT, 9) + 12)
+        for cell in longest
+    ]
+    col_widths = _table_col_widths(natural, PDF_FRAME_WIDTH)
+
+    max_plain_chars = [int(len(longest[j]) * col_widths[j] / natural[j]) for j in range(ncols)]
+
+    def cell_flowable(cell, j, header):
+        if header:
+            return _paragraph(cell, styles["CustomTableHeader"])
+        if "<" not in cell and len(cell) <= max_plain_chars[j]:
+            return html.unescape(cell) if "&" in cell else cell
+        return _paragraph(cell, styles["CustomTableCell"])
+
+    header = [
+        [cell_flowable(c, j, True) for j, c in enumerate(row)] + [""] * (ncols - len(row))
+        for row in rows[:header_rows]
+    ]
+    table_style = [
+        ("FONTNAME", (0, 0), (-1, -1), PDF_BODY_FONT),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#CCCCCC")),
+        ("ROWBACKGROUNDS", (0, header_rows), (-1, -1), [colors.white, colors.HexColor("#F5F5F5")]),
+    ]
+    if header_rows:
+        table_style.append(("BACKGROUND", (0, 0), (-1, header_rows - 1), colors.HexColor("#1C3F77")))
+
+    body = rows[header_rows:] or [[]]
+    for start in range(0, len(body), PDF_TABLE_CHUNK_ROWS):
+        data = header + [
+            [cell_flowable(c, j, False) for j, c in enumerate(row)] + [""] * (ncols - len(row))
+            for row in body[start:start + PDF_TABLE_CHUNK_ROWS]
+        ]
+        table = LongTable(data, colWidths=col_widths, repeatRows=header_rows, hAlign="LEFT")
+        table.setStyle(TableStyle(table_style))
+        yield table
+    yield Spacer(1, 10)
+
+_CODE_MARKUP_CACHE_SIZE = 256
+_code_markup_cache = collections.OrderedDict()
+_code_markup_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _code_style():
+    if lex is None or not PDF_CODE_STYLE or PDF_CODE_STYLE.lower() == "none":
+        return None
+    try:
+        return get_style_by_name(PDF_CODE_STYLE)
+    except ClassNotFound:
+        log.warning("Unknown PDF_CODE_STYLE %s, code blocks will not be highlighted", PDF_CODE_STYLE)
+        return None
+
+@functools.lru_cache(maxsize=None)
+def _token_style(ttype) -> dict:
+    """PDF_CODE_STYLE entry for a pygments token type, falling back to its closest styled parent."""
+    style = _code_style()
+    while ttype not in style and ttype.parent is not None:
+        ttype = ttype.parent
+    return style.style_for_token(ttype)
+
+@functools.lru_cache(maxsize=None)
+def _token_markup(ttype) -> tuple[str, str]:
+    """Opening and closing Paragraph markup for a pygments token type."""
+    style = _token_style(ttype)
+    opening, closing = "", ""
+    if style["color"]:
+        opening, closing = f'<font color="#{style["color"]}">', "</font>"
+    if style["bold"]:
+        opening, closing = opening + "<b>", "</b>" + closing
+    if style["italic"]:
+        opening, closing = opening + "<i>", "</i>" + closing
+    return opening, closing
+
+@functools.lru_cache(maxsize=1)
+def _code_line_chars() -> int:
+    style = styles["CustomCode"]
+    usable = PDF_FRAME_WIDTH - style.leftIndent - style.rightIndent - 2 * style.borderPadding - 4
+    return max(20, int(usable / stringWidth("M", style.fontName, style.fontSize)))
+
+def _highlight_code(code: str, language: str = None) -> str:
+    """XPreformatted markup for code: escaped, colourised when the language is known, hard-wrapped to the frame."""
+    tokens = None
+    if language and _code_style() is not None:
+        try:
+            tokens = lex(code, get_lexer_by_name(language, stripnl=False, ensurenl=False))
+        except ClassNotFound:
+            log.debug("No lexer for code block language '%s'", language)
+    if tokens is None:
+        tokens = [(None, code)]
+    width = _code_line_chars()
+    parts = []
+    run, run_markup = [], ("", "")
+    column = 0
+    for ttype, value in tokens:
+        markup = _token_markup(ttype) if ttype is not None else ("", "")
+        if markup != run_markup:
+            if run:
+                parts.append(run_markup[0] + html.escape("".join(run), quote=False) + run_markup[1])
+            run, run_markup = [], markup
+        for i, line in enumerate(value.split("\n")):
+            if i:
+                run.append("\n")
+                column = 0
+            while line:
+                if column >= width:
+                    run.append("\n")
+                    column = 0
+                piece, line = line[:width - column], line[width - column:]
+                run.append(piece)
+                column += len(piece)
+    if run:
+        parts.append(run_markup[0] + html.escape("".join(run), quote=False) + run_markup[1])
+    return "".join(parts)
+
+def _code_flowable(code: str, language: str = None) -> XPreformatted:
+    """A code block that keeps its line breaks and splits across pages."""
+    code = code.expandtabs(4)
+    key = (hashlib.sha1(code.encode("utf-8")).hexdigest(), (language or "").lower())
+    with _code_markup_lock:
+        markup = _code_markup_cache.get(key)
+        if markup is not None:
+            _code_markup_cache.move_to_end(key)
+    if markup is None:
+        markup = _highlight_code(code, key[1])
+        with _code_markup_lock:
+            _code_markup_cache[key] = markup
+            if len(_code_markup_cache) > _CODE_MARKUP_CACHE_SIZE:
+                _code_markup_cache.popitem(last=False)
+    return XPreformatted(markup, styles["CustomCode"])
+
+def _img_tag_source(tag: str) -> tuple[str, str]:
+    attrs = {m.group(1).lower(): html.unescape(m.group(2) if m.group(2) is not None else m.group(3))
+             for m in _HTML_ATTR_RE.finditer(tag)}
+    return attrs.get("src"), attrs.get("alt", "[Image]")
+
+def _md_block_end(tokens, i: int) -> int:
+    """Index of the token closing the block opened at tokens[i]."""
+    if tokens[i].nesting != 1:
+        return i
+    depth = 0
+    for j in range(i, len(tokens)):
+        depth += tokens[j].nesting
+        if depth == 0:
+            return j
+    return len(tokens) - 1
+
+def _md_inline_markup(inline, pending_images: list) -> str:
+    """Turn an inline token into ReportLab paragraph markup; images are collected aside."""
+    parts = []
+    for tok in inline.children or []:
+        t = tok.type
+        if t == "text":
+            parts.append(_plain_text_markup(tok.content))
+        elif t in ("softbreak", "hardbreak"):
+            parts.append("<br/>")
+        elif t == "strong_open":
+            parts.append("<b>")
+        elif t == "strong_close":
+            parts.append("</b>")
+        elif t == "em_open":
+            parts.append("<i>")
+        elif t == "em_close":
+            parts.append("</i>")
+        elif t == "s_open":
+            parts.append("<strike>")
+        elif t == "s_close":
+            parts.append("</strike>")
+        elif t == "code_inline":
+            parts.append(f'<font face="{PDF_CODE_FONT}">{html.escape(tok.content, quote=False)}</font>')
+        elif t == "link_open":
+            parts.append(f'<a href="{html.escape(tok.attrGet("href") or "")}" color="blue">')
+        elif t == "link_close":
+            parts.append("</a>")
+        elif t == "image":
+            pending_images.append((tok.attrGet("src"), tok.content or "[Image]"))
+        elif t == "html_inline":
+            if _IMG_TAG_RE.match(tok.content):
+                pending_images.append(_img_tag_source(tok.content))
+            elif _BR_TAG_RE.match(tok.content):
+                parts.append("<br/>")
+    markup = "".join(parts)
+    while markup.startswith("<br/>"):
+        markup = markup[5:]
+    while markup.endswith("<br/>"):
+        markup = markup[:-5]
+    return markup.strip()
+
+def _md_list(tokens, start: int, end: int, images: ImageRegistry, nested: bool):
+    items = []
+    j = start + 1
+    while j < end:
+        if tokens[j].type == "list_item_open":
+            item_end = _md_block_end(tokens, j)
+            flowables = list(_render_md_range(tokens, j + 1, item_end, images, list_item=True))
+            if flowables:
+                items.append(ListItem(flowables))
+            j = item_end + 1
+        else:
+            j += 1
+    if not items:
+        return None
+    is_ordered = tokens[start].type == "ordered_list_open"
+    first = tokens[start].attrGet("start")
+    return ListFlowable(
+        items,
+        bulletType='1' if is_ordered else 'bullet',
+        start=int(first) if is_ordered and first else None,
+        leftIndent=10 * mm,
+        bulletIndent=5 * mm,
+        spaceBefore=2 if nested else 6,
+        spaceAfter=2 if nested else 10
+    )
+
+def _md_table_rows(tokens, start: int, end: int) -> tuple[list[list[str]], int]:
+    rows, row, header_rows, in_head = [], [], 0, False
+    for j in range(start, end):
+        tok = tokens[j]
+        if tok.type == "inline":
+            row.append(_md_inline_markup(tok, []))
+        elif tok.type == "thead_open":
+            in_head = True
+        elif tok.type == "thead_close":
+            in_head = False
+        elif tok.type == "tr_close":
+            rows.append(row)
+            row = []
+            if in_head:
+                header_rows += 1
+    return rows, header_rows
+
+def _render_md_range(tokens, start: int, end: int, images: ImageRegistry, list_item: bool = False):
+    text_style = styles["CustomListItem" if list_item else "CustomNormal"]
+    i = start
+    while i < end:
+        story = []
+        tok = tokens[i]
+        block_end = _md_block_end(tokens, i)
+        t = tok.type
+        if t in ("heading_open", "paragraph_open"):
+            pending_images = []
+            markup = _md_inline_markup(tokens[i + 1], pending_images)
+            if markup:
+                if t == "heading_open":
+                    style_name, space = _HEADING_STYLES.get(int(tok.tag[1]), ("CustomNormal", 6))
+                    story.append(_paragraph(markup, styles[style_name]))
+                    story.append(Spacer(1, space))
+                else:
+                    story.append(_paragraph(markup, text_style))
+                    if not list_item:
+                        story.append(Spacer(1, 6))
+            for src, alt in pending_images:
+                _append_image(story, src, alt, images)
+        elif t in ("bullet_list_open", "ordered_list_open"):
+            flowable = _md_list(tokens, i, block_end, images, nested=list_item)
+            if flowable is not None:
+                story.append(flowable)
+        elif t == "blockquote_open":
+            yield from _render_md_range(tokens, i + 1, block_end, images, list_item)
+        elif t in ("fence", "code_block"):
+            code = tok.content.strip("\n").rstrip()
+            if code:
+                story.append(_code_flowable(code, tok.info.split()[0] if tok.info.strip() else None))
+                story.append(Spacer(1, 8))
+        elif t == "html_block":
+            for tag in _IMG_TAG_RE.findall(tok.content):
+                src, alt = _img_tag_source(tag)
+                _append_image(story, src, alt, images)
+            text = html.unescape(_HTML_TAG_RE.sub("", _IMG_TAG_RE.sub("", tok.content))).strip()
+            if text:
+                story.append(_paragraph(html.escape(text, quote=False), text_style))
+                story.append(Spacer(1, 6))
+        elif t == "table_open":
+            rows, header_rows = _md_table_rows(tokens, i, block_end)
+            yield from _table_flowables(rows, header_rows)
+        yield from story
+        i = block_end + 1
+
+def render_markdown_tokens(tokens, images: ImageRegistry = None) -> list:
+    """Build the ReportLab story straight from a markdown-it token stream."""
+    log.debug("Starting render_markdown_tokens with %s tokens...", len(tokens))
+    if images is None:
+        images = ImageRegistry()
+    story = list(_render_md_range(tokens, 0, len(tokens), images))
+    log.debug("Finished render_markdown_tokens. Story contains %s elements.", len(story))
     return story
 
+def iter_markdown_tokens(tokens, images: ImageRegistry = None):
+    """Yield the story for tokens one top-level block at a time."""
+    if images is None:
+        images = ImageRegistry()
+    i = 0
+    while i < len(tokens):
+        block_end = _md_block_end(tokens, i)
+        yield from _render_md_range(tokens, i, block_end + 1, images)
+        i = block_end + 1
+
+class _FlowableStream:
+    """List-like story that pulls flowables from an iterator as doc.build needs them."""
+
+    def __init__(self, flowables, lookahead: int = PDF_STREAM_LOOKAHEAD):
+        self._source = iter(flowables)
+        self._buffer = []
+        self._lookahead = lookahead
+        self.consumed = 0
+
+    def _fill(self):
+        # A table chunk holds hundreds of rows; never read ahead past one.
+        while self._source is not None and len(self._buffer) < self._lookahead:
+            if self._buffer and isinstance(self._buffer[-1], LongTable):
+                break
+            try:
+                self._buffer.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return len(self._buffer)
+
+    def __getitem__(self, index):
+        self._fill()
+        return self._buffer[index]
+
+    def __setitem__(self, index, value):
+        self._buffer[index] = value
+
+    def __delitem__(self, index):
+        before = len(self._buffer)
+        del self._buffer[index]
+        self.consumed += before - len(self._buffer)
+
+    def insert(self, index, value):
+        self._buffer.insert(index, value)
+
+def _resolve_html_parser(name: str) -> str:
+    """Pick the BeautifulSoup tree builder: lxml when installed, html.parser otherwise."""
+    candidates = ["lxml", "html.parser"] if name == "auto" else [name, "html.parser"]
+    for candidate in candidates:
+        try:
+            BeautifulSoup("", candidate)
+            return candidate
+        except FeatureNotFound:
+            if candidate == name:
+                log.warning("HTML parser '%s' is not installed, falling back to html.parser", name)
+    return "html.parser"
+
+HTML_PARSER_BACKEND = _resolve_html_parser(HTML_PARSER)
+log.debug("HTML parser backend -> %s", HTML_PARSER_BACKEND)
+
+def _parse_html(html_text: str):
+    """Parse an HTML fragment and return the node whose children are its top-level elements."""
+    soup = BeautifulSoup(html_text, HTML_PARSER_BACKEND)
+    if HTML_PARSER_BACKEND != "html.parser" and soup.body is not None:
+        return soup.body
+    return soup
+
+_MARKDOWN2_EXTRAS = ['fenced-code-blocks', 'tables', 'break-on-newline', 'cuddled-lists']
+
+def _markdown2_html(md_text: str, safe_mode: str = None) -> str:
+    return markdown2.markdown(md_text, extras=_MARKDOWN2_EXTRAS, safe_mode=safe_mode)
+
+def _markdown_to_story(md_text: str, images: ImageRegistry, tokens: list = None) -> list:
+    if PDF_RENDERER == "markdown" and _markdown_parser is not None:
+        if tokens is None:
+            log.debug("Tokenizing Markdown...")
+            with _log_phase("parse"):
+                tokens = _parse_markdown(md_text)
+        with _log_phase("render"):
+            if PDF_STREAMING:
+                return _FlowableStream(iter_markdown_tokens(tokens, images))
+            return render_markdown_tokens(tokens, images)
+
+    log.debug("Converting Markdown to HTML...")
+    with _log_phase("markdown"):
+        html_text = _markdown2_html(md_text)
+    log.debug("Generated HTML:\n%s", html_text) 
+
+    log.debug("Parsing HTML with BeautifulSoup (%s)...", HTML_PARSER_BACKEND)
+    with _log_phase("parse"):
+        soup = _parse_html(html_text)
+    log.debug("Rendering HTML elements to ReportLab story...")
+    with _log_phase("render"):
+        if PDF_STREAMING:
+            return _FlowableStream(iter_html_elements(soup, images))
+        return render_html_elements(soup, images)
+
+_OUTLINE_LEVELS = {"CustomHeading1": 0, "CustomHeading2": 1, "CustomHeading3": 2}
+
+class _FailedFlowable(Paragraph):
+    """Placeholder for a flowable that raised during layout."""
+
+class _OutlineDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate that adds CustomHeading1-3 paragraphs to the PDF outline."""
+
+    def handle_flowable(self, flowables):
+        flowable = flowables[0]
+        try:
+            super().handle_flowable(flowables)
+        except Exception as e:
+            if isinstance(flowable, _FailedFlowable):
+                raise
+            # Lose this flowable, not the whole document.
+            log.error("Could not lay out %s, replacing it with a placeholder: %s", type(flowable).__name__, e)
+            if flowables and flowables[0] is flowable:
+                del flowables[0]
+            flowables.insert(0, _FailedFlowable("[Content could not be rendered]", styles["CustomNormal"]))
+
+    def beforeDocument(self):
+        self.headings = []
+        self._outline_key = uuid.uuid4().hex[:8]
+        self._outline_level = -1
+
+    def afterFlowable(self, flowable):
+        level = _OUTLINE_LEVELS.get(getattr(getattr(flowable, "style", None), "name", None))
+        if level is None:
+            return
+        title = flowable.getPlainText()
+        key = f"h{self._outline_key}_{len(self.headings)}"
+        self.headings.append((level, title, self.page - 1))
+        # ReportLab refuses outline entries that skip a level.
+        self._outline_level = min(level, self._outline_level + 1)
+        self.canv.bookmarkPage(key)
+        self.canv.addOutlineEntry(title, key, level=self._outline_level, closed=self._outline_level > 0)
+
+def _build_pdf(filepath, md_text: str, images: ImageRegistry, tokens: list = None) -> list:
+    """Render md_text into filepath (a path or file object) and return its outline headings."""
+    story = _markdown_to_story(md_text, images, tokens)
+    log.debug("Story generated with %s elements.", len(story))
+    if not story:
+        log.warning("Story is empty, adding 'Empty Content' paragraph.")
+        story = [Paragraph("Empty Content", styles["CustomNormal"])]
+
+    doc = _OutlineDocTemplate(
+        filepath,
+        topMargin=72,
+        bottomMargin=72,
+        leftMargin=72,
+        rightMargin=72,
+        # Fixed dates and document ID, so identical content gives identical bytes for the blob store.
+        invariant=EXPORT_DEDUP,
+    )
+    try:
+        log.debug("Calling doc.build with story containing %s elements.", len(story))
+        with _log_phase("build"):
+            doc.build(story)
+        if isinstance(story, _FlowableStream):
+            log.debug("Streamed %s flowables into the PDF.", story.consumed)
+    except Exception as e:
+        log.error("Error in PDF building: %s", e, exc_info=True)
+        log.debug("Attempting to build PDF with error message...")
+        simple_story = [Paragraph("Error in PDF generation", styles["CustomNormal"])]
+        try:
+            doc.build(simple_story)
+            log.debug("Error PDF created successfully.")
+        except Exception as e2:
+            log.error("Failed to create even the error PDF: %s", e2, exc_info=True)
+    return doc.headings
+
+_PDF_SPLIT_HEADING_RE = re.compile(r"^ {0,3}#{1,2}(?:[ \t]|$)")
+_MD_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+def _split_markdown_chunks(md_text: str, count: int) -> list[str]:
+    """Split md_text at H1/H2 headings outside code fences into about count chunks of similar size."""
+    sections, current, fence = [], [], None
+    for line in md_text.split("\n"):
+        match = _MD_FENCE_RE.match(line)
+        if fence:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+        elif match:
+            fence = match.group(1)
+        elif current and _PDF_SPLIT_HEADING_RE.match(line):
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    sections.append("\n".join(current))
+
+    target = len(md_text) / count
+    chunks, pending, size = [], [], 0
+    for section in sections:
+        pending.append(section)
+        size += len(section) + 1
+        if size >= target:
+            chunks.append("\n".join(pending))
+            pending, size = [], 0
+    if pending:
+        chunks.append("\n".join(pending))
+    return chunks
+
+def _render_pdf_chunk(md_text: str, generated: dict) -> tuple[bytes, list]:
+    """Worker process entry point: render one chunk to PDF bytes plus its outline headings."""
+    images = ImageRegistry()
+    for src, data in generated.items():
+        images._store(data, src)
+    buffer = BytesIO()
+    headings = _build_pdf(buffer, md_text, images)
+    return buffer.getvalue(), headings
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _pdf_worker_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn rather than fork: the server process runs threads (cleanup timers, the MCP loop).
+            _pdf_pool = ProcessPoolExecutor(PDF_PARALLEL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+def _merge_pdf_parts(filepath: str, parts: list[tuple[bytes, list]]):
+    """Concatenate rendered parts and rebuild the outline with page offsets."""
+    writer = PdfWriter()
+    offset = 0
+    parents = {}
+    last_level = -1
+    for data, headings in parts:
+        reader = PdfReader(BytesIO(data))
+        writer.append(reader, import_outline=False)
+        for level, title, page in headings:
+            last_level = min(level, last_level + 1)
+            parents[last_level] = writer.add_outline_item(
+                title, offset + page, parent=parents.get(last_level - 1), is_open=last_level == 0
+            )
+        offset += len(reader.pages)
+    with open(filepath, "wb") as f:
+        writer.write(f)
+    return offset
+
+def _build_pdf_parallel(filepath: str, md_text: str, images: ImageRegistry) -> bool:
+    """Render large documents as H1/H2 chunks in worker processes and merge them; False if rendered serially."""
+    if PDF_PARALLEL_WORKERS < 2 or PdfWriter is None or len(md_text) < PDF_PARALLEL_MIN_CHARS:
+        return False
+    chunks = _split_markdown_chunks(md_text, PDF_PARALLEL_WORKERS * 2)
+    if len(chunks) < 2:
+        return False
+    generated = images.generated_images()
+    global _pdf_pool
+    try:
+        with _log_phase("parallel render"):
+            pool = _pdf_worker_pool()
+            futures = [
+                pool.submit(_render_pdf_chunk, chunk, {src: data for src, data in generated.items() if src in chunk})
+                for chunk in chunks
+            ]
+            parts = [future.result() for future in futures]
+        with _log_phase("merge"):
+            pages = _merge_pdf_parts(filepath, parts)
+    except Exception as e:
+        log.warning("Parallel PDF rendering failed, falling back to a single process: %s", e, exc_info=True)
+        with _pdf_pool_lock:
+            if _pdf_pool is not None:
+                _pdf_pool.shutdown(wait=False, cancel_futures=True)
+                _pdf_pool = None
+        return False
+    log.debug("Merged %s PDF chunks into %s pages.", len(parts), pages)
+    return True
+
+_IMAGE_QUERY_RE = re.compile(r'!\[[^\]]*\]\(\s*image_query:\s*([^)]+)\)')
+
+def _resolve_image_queries(md_text: str, images: ImageRegistry, markdown_images: bool = False) -> str:
+    """Replace ![...](image_query: ...) placeholders with <img> tags (or Markdown images) for the images found."""
+    def replace_image_query(match):
+        query = match.group(1).strip()
+        log.debug("Found image_query placeholder: '%s'", query)
+        image_url = images.url_for_query(query)
+
+        if image_url and markdown_images:
+            result_tag = f'![Searched image: {query}]({image_url})'
+            log.debug("Replaced image_query '%s' with URL: %s", query, image_url)
+        elif image_url:
+            result_tag = f'\n\n<img src="{image_url}" alt="Searched image: {query}" />\n\n'
+            log.debug("Replaced image_query '%s' with URL: %s", query, image_url)
+        else:
+            result_tag = ""
+            log.warning("Failed to find image for query: '%s'", query)
+
+        log.debug("Replacement result: %s", result_tag)
+        return result_tag
+
+    log.debug("Applying image_query regex replacement...")
+    with _log_phase("images"):
+        images.prefetch(_IMAGE_QUERY_RE.findall(md_text))
+        resolved = _IMAGE_QUERY_RE.sub(replace_image_query, md_text)
+    if resolved != md_text:
+        log.debug("Markdown text after replacement:\n%s", resolved)
+    else:
+        log.debug("No image_query replacements were made.")
+    return resolved
+
 def _cleanup_files(folder_path: str, delay_minutes: int):
     def delete_files():
         time.sleep(delay_minutes * 60)
         try:
-            import shutil
-            shutil.rmtree(folder_path) 
-            log.debug(f"Folder {folder_path} deleted.")
+            _remove_export_folder(folder_path)
+            log.debug("Folder %s deleted.", folder_path)
         except Exception as e:
-            logging.error(f"Error deleting files : {e}")
+            logging.error("Error deleting files : %s", e)
     thread = threading.Thread(target=delete_files)
     thread.start()
 
+def _finalize_export(folder_path: str, persistent: bool):
+    if EXPORT_DEDUP and storage.root == EXPORT_DIR:
+        _dedupe_export(folder_path)
+    expires = _register_export(folder_path, persistent)
+    links = _export_links(folder_path, expires) if SIGNING_KEY and storage.signed_links else None
+    try:
+        _enforce_quota(_caller_id.get(), exclude=folder_path)
+        with _log_phase("publish"):
+            storage.publish(folder_path)
+    except Exception:
+        _remove_export_folder(folder_path)
+        raise
+    if not persistent:
+        _cleanup_files(folder_path, FILES_DELAY)
+    return links
+
+try:
+    if multiprocessing.parent_process() is None:
+        _init_export_index()
+        _purged = _purge_expired_exports()
+        _purged_blobs = _purge_orphan_blobs()
+        _stats = _export_stats()
+        log.info("Export index: %s artifacts (%s persistent), %s bytes, %s expired purged, %s orphan blobs purged",
+                 _stats["count"], _stats["persistent"], _stats["size"], _purged, _purged_blobs)
+except sqlite3.Error as e:
+    log.warning("Export index unavailable at %s: %s", EXPORT_INDEX_PATH, e)
+
 @mcp.tool()
+@_with_request_id
 def create_excel(data: list[list[str]], filename: str = None, persistent: bool = PERSISTENT_FILES) -> dict:
     folder_path = _generate_unique_folder()
     filepath, fname = _generate_filename(folder_path, "xlsx", filename)
@@ -498,101 +2000,163 @@ def create_excel(data: list[list[str]], filename: str = None, persistent: bool =
     for row in data:
         ws.append(row)
     wb.save(filepath)
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-    return {"url": _public_url(folder_path, fname)}
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, fname, links)}
 
 @mcp.tool()
+@_with_request_id
 def create_csv(data: list[list[str]], filename: str = None, persistent: bool = PERSISTENT_FILES) -> dict:
     folder_path = _generate_unique_folder()
     filepath, fname = _generate_filename(folder_path, "csv", filename)
     with open(filepath, "w", newline="", encoding="utf-8") as f:
         csv.writer(f).writerows(data)
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-    return {"url": _public_url(folder_path, fname)}
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, fname, links)}
 
 @mcp.tool()
+@_with_request_id
 def create_pdf(text: list[str], filename: str = None, persistent: bool = PERSISTENT_FILES) -> dict:
     log.debug("Starting create_pdf tool...")
     folder_path = _generate_unique_folder()
     filepath, fname = _generate_filename(folder_path, "pdf", filename)
+    images = ImageRegistry()
     md_text = "\n".join(text)
-    log.debug(f"Input Markdown text:\n{md_text}")
+    log.debug("Input Markdown text:\n%s", md_text)
 
-    def replace_image_query(match):
-        query = match.group(1).strip()
-        log.debug(f"Found image_query placeholder: '{query}'")
-        image_url = search_image(query)
+    md_text = _resolve_image_queries(md_text, images)
 
-        if image_url:
-            result_tag = f'\n\n<img src="{image_url}" alt="Searched image: {query}" />\n\n'
-            log.debug(f"Replaced image_query '{query}' with URL: {image_url}")
+    log.debug("Building PDF document at %s...", filepath)
+    if not _build_pdf_parallel(filepath, md_text, images):
+        _build_pdf(filepath, md_text, images)
+    log.debug("PDF creation finished: %s", filepath)
+
+    links = _finalize_export(folder_path, persistent)
+    log.debug("create_pdf tool finished.")
+    return {"url": _public_url(folder_path, fname, links)}
+
+_HTML_STYLESHEET = """
+body { margin: 0; background: #f5f6f8; color: #1f2328; font: 16px/1.6 -apple-system, "Segoe UI", Helvetica, Arial, sans-serif; }
+main { max-width: 820px; margin: 2rem auto; padding: 2.5rem 3rem; background: #fff; box-shadow: 0 1px 4px rgba(0, 0, 0, .08); }
+h1 { color: #0A1F44; font-size: 1.9rem; } h2 { color: #1C3F77; font-size: 1.5rem; } h3 { color: #3A6FB0; font-size: 1.2rem; }
+a { color: #0563C1; }
+img { display: block; max-width: 100%; height: auto; margin: 1rem 0; }
+table { border-collapse: collapse; margin: 1rem 0; width: 100%; }
+th, td { border: 1px solid #c9ced6; padding: .4rem .6rem; text-align: left; vertical-align: top; }
+th { background: #D9E2F3; }
+blockquote { margin: 1rem 0; padding: .2rem 1rem; border-left: 4px solid #c9ced6; color: #57606a; }
+code, pre { font-family: Consolas, "DejaVu Sans Mono", monospace; font-size: .9em; }
+pre { padding: .8rem 1rem; overflow-x: auto; background: #f6f8fa; border: 1px solid #e1e4e8; }
+@media print { body { background: #fff; } main { box-shadow: none; margin: 0; max-width: none; } }
+"""
+_HTML_IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\bsrc=")([^"]*)(")', re.IGNORECASE)
+
+_HTML_FRAGMENT_KEEP_RE = re.compile(r"<img\b[^>]*>|<br\s*/?>", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1)
+def _html_code_formatter():
+    style = _code_style()
+    return HtmlFormatter(style=style, cssclass="codehilite") if style is not None else None
+
+def _html_code_css() -> str:
+    formatter = _html_code_formatter()
+    return formatter.get_style_defs(".codehilite") if formatter is not None else ""
+
+def _html_safe_fragment(fragment: str) -> str:
+    """Escape raw HTML from the Markdown, keeping <img> and <br> tags rebuilt from their attributes."""
+    parts = []
+    pos = 0
+    for match in _HTML_FRAGMENT_KEEP_RE.finditer(fragment):
+        parts.append(escapeHtml(fragment[pos:match.start()]))
+        tag = match.group(0)
+        if tag[1:3].lower() == "br":
+            parts.append("<br>")
         else:
-            result_tag = ""
-            log.warning(f"Failed to find image for query: '{query}'")
+            src, alt = _img_tag_source(tag)
+            if src:
+                parts.append(f'<img src="{html.escape(src)}" alt="{html.escape(alt)}">')
+        pos = match.end()
+    parts.append(escapeHtml(fragment[pos:]))
+    return "".join(parts)
 
-        log.debug(f"Replacement result: {result_tag}")
-        return result_tag
+def _html_fence(tokens, idx, options, env):
+    token = tokens[idx]
+    formatter = _html_code_formatter()
+    language = token.info.split()[0] if token.info.strip() else None
+    if language and formatter is not None:
+        try:
+            return highlight(token.content, get_lexer_by_name(language), formatter)
+        except ClassNotFound:
+            log.debug("No lexer for code block language '%s'", language)
+    return f"<pre><code>{escapeHtml(token.content)}</code></pre>\n"
 
-    log.debug("Applying image_query regex replacement...")
-    md_text_before_replace = md_text
-    md_text = re.sub(r'!\[[^\]]*\]\(\s*image_query:\s*([^)]+)\)', replace_image_query, md_text)
-    if md_text != md_text_before_replace:
-        log.debug(f"Markdown text after replacement:\n{md_text}")
-    else:
-        log.debug("No image_query replacements were made.")
+def _html_renderer():
+    renderer = RendererHTML()
+    renderer.rules["text"] = lambda tokens, idx, options, env: escapeHtml(replace_emoji_aliases(tokens[idx].content))
+    renderer.rules["html_block"] = lambda tokens, idx, options, env: _html_safe_fragment(tokens[idx].content) + "\n"
+    renderer.rules["html_inline"] = lambda tokens, idx, options, env: _html_safe_fragment(tokens[idx].content)
+    renderer.rules["fence"] = _html_fence
+    return renderer
 
-    log.debug("Converting Markdown to HTML...")
-    html = markdown2.markdown(
-        md_text,
-        extras=[
-            'fenced-code-blocks',
-            'tables',
-            'break-on-newline',
-            'cuddled-lists', 
-        ]
-    )
-    log.debug(f"Generated HTML:\n{html}") 
+_html_token_renderer = _html_renderer() if MarkdownIt else None
 
-    log.debug("Parsing HTML with BeautifulSoup...")
-    soup = BeautifulSoup(html, "html.parser")
-    log.debug("Rendering HTML elements to ReportLab story...")
-    story = render_html_elements(soup)
-    log.debug(f"Story generated with {len(story)} elements.")
-    if not story:
-        log.warning("Story is empty, adding 'Empty Content' paragraph.")
-        story = [Paragraph("Empty Content", styles["CustomNormal"])]
+def _inline_html_images(html_text: str, images: ImageRegistry, inline: bool = True) -> str:
+    """Swap <img> sources for base64 data URIs of the registry's bytes."""
+    def replace(match):
+        src = html.unescape(match.group(2))
+        if not (inline or src.startswith("local_sd:")) or src.startswith("data:"):
+            return match.group(0)
+        if not (_is_image_url(src) or images.has(src)):
+            log.warning("Not inlining local image path %s", src)
+            return match.group(0)
+        try:
+            data = images.get_bytes(src)
+            with PILImage.open(BytesIO(data)) as img:
+                mime = PILImage.MIME.get(img.format)
+        except Exception as e:
+            log.warning("Could not inline image %s: %s", src, e)
+            return match.group(0)
+        if not mime:
+            return match.group(0)
+        return f"{match.group(1)}data:{mime};base64,{base64.b64encode(data).decode('ascii')}{match.group(3)}"
 
-    log.debug(f"Creating SimpleDocTemplate at {filepath}...")
-    doc = SimpleDocTemplate(
-        filepath,
-        topMargin=72,
-        bottomMargin=72,
-        leftMargin=72,
-        rightMargin=72
+    return _HTML_IMG_SRC_RE.sub(replace, html_text)
+
+def _build_html(md_text: str, images: ImageRegistry, title: str = None, inline_images: bool = True) -> str:
+    """A standalone HTML page for md_text, with its stylesheet embedded."""
+    if PDF_RENDERER == "markdown" and _markdown_parser is not None:
+        md_text = _resolve_image_queries(md_text, images)
+        with _log_phase("parse"):
+            tokens = _parse_markdown(md_text)
+        with _log_phase("render"):
+            body = _html_token_renderer.render(tokens, _markdown_parser.options, {})
+    else:
+        md_text = _resolve_image_queries(replace_emoji_aliases(md_text), images, markdown_images=True)
+        with _log_phase("markdown"):
+            body = _markdown2_html(md_text, safe_mode="escape")
+    with _log_phase("images"):
+        body = _inline_html_images(body, images, inline_images)
+    title = html.escape(title or "Document")
+    return (
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">\n'
+        f"<title>{title}</title>\n<style>{_HTML_STYLESHEET}{_html_code_css()}</style>\n"
+        f"</head>\n<body>\n<main>\n{body}\n</main>\n</body>\n</html>\n"
     )
-    try:
-        log.debug("Attempting to build PDF document...")
-        log.debug(f"Calling doc.build with story containing {len(story)} elements.")
-        doc.build(story)
-        log.debug(f"PDF creation succeed: {filepath}")
-    except Exception as e:
-        log.error(f"Error in PDF building: {e}", exc_info=True) 
-        log.debug("Attempting to build PDF with error message...")
-        simple_story = [Paragraph("Error in PDF generation", styles["CustomNormal"])]
-        try:
-            doc.build(simple_story)
-            log.debug("Error PDF created successfully.")
-        except Exception as e2:
-            log.error(f"Failed to create even the error PDF: {e2}", exc_info=True)
 
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-    log.debug("create_pdf tool finished.")
-    return {"url": _public_url(folder_path, fname)}
+@mcp.tool()
+@_with_request_id
+def create_html(text: list[str], filename: str = None, persistent: bool = PERSISTENT_FILES, title: str = None, inline_images: bool = True) -> dict:
+    folder_path = _generate_unique_folder()
+    filepath, fname = _generate_filename(folder_path, "html", filename)
+    images = ImageRegistry()
+    page = _build_html("\n".join(text), images, title, inline_images)
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write(page)
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, fname, links)}
 
 @mcp.tool()
+@_with_request_id
 def create_file(content: str, filename: str, persistent: bool = PERSISTENT_FILES) -> dict:
     folder_path = _generate_unique_folder()
     base, ext = os.path.splitext(filename)
@@ -606,123 +2170,636 @@ def create_file(content: str, filename: str, persistent: bool = PERSISTENT_FILES
         content = f'<?xml version="1.0" encoding="UTF-8"?>\n{content}'
     with open(filepath, "w", encoding="utf-8") as f:
         f.write(content)
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-    return {"url": _public_url(folder_path, filename)}
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, filename, links)}
 
-@mcp.tool()
-def create_presentation(slides_data: list[dict], filename: str = None, persistent: bool = PERSISTENT_FILES, title: str = None) -> dict:
-    folder_path = _generate_unique_folder()
-    filepath, fname = _generate_filename(folder_path, "pptx", filename)
-    prs = Presentation()
-    title_slide_layout = prs.slide_layouts[0]
-    slide = prs.slides.add_slide(title_slide_layout)
-    title_shape = slide.shapes.title
-    title_shape.text = title
+_pptx_templates = {}
+_pptx_template_lock = threading.Lock()
+
+_PPTX_IMAGE_SIZES = {"small": (2, 1.5), "medium": (3, 2), "large": (4, 3)}
+# image_position -> ((image left, top), (content left, top, width, height)), in inches on a 10 x 7.5 in slide
+_PPTX_IMAGE_LAYOUTS = {
+    "left": ((0.5, 1.5), (4.5, 1.5, 5, 4)),
+    "right": ((5.5, 1.5), (0.5, 1.5, 5, 4)),
+    "top": ((5.5, 0.5), (0.5, 2.5, 7, 3)),
+    "bottom": ((5.5, 4.5), (0.5, 0.5, 7, 3)),
+}
+_PPTX_CONTENT_BOX = (0.5, 1.5, 7, 4)
+_PPTX_WIDE_BOX = (0.5, 1.5, 9, 5.5)
+_PPTX_COLUMN_BOXES = ((0.5, 1.5, 4.4, 5.5), (5.1, 1.5, 4.4, 5.5))
+# slide type -> (layout name, fallback layout index in the default template)
+_PPTX_SLIDE_TYPES = {
+    "content": ("Title and Content", 1),
+    "two_column": ("Two Content", 3),
+    "table": ("Title Only", 5),
+    "chart": ("Title Only", 5),
+}
+_PPTX_CHART_TYPES = {
+    "column": XL_CHART_TYPE.COLUMN_CLUSTERED,
+    "stacked_column": XL_CHART_TYPE.COLUMN_STACKED,
+    "bar": XL_CHART_TYPE.BAR_CLUSTERED,
+    "stacked_bar": XL_CHART_TYPE.BAR_STACKED,
+    "line": XL_CHART_TYPE.LINE_MARKERS,
+    "area": XL_CHART_TYPE.AREA,
+    "pie": XL_CHART_TYPE.PIE,
+    "doughnut": XL_CHART_TYPE.DOUGHNUT,
+    "scatter": XL_CHART_TYPE.XY_SCATTER,
+}
+
+def _load_presentation(template: str = None) -> Presentation:
+    """Start a deck, deep-copied from a cached parse of the named template."""
+    if not template:
+        return Presentation()
+    path = os.path.join(PPTX_TEMPLATE_DIR, os.path.basename(template))
+    if not path.lower().endswith(".pptx"):
+        path += ".pptx"
+    if not os.path.isfile(path):
+        raise ValueError(f"Unknown presentation template '{template}'")
+    mtime = os.path.getmtime(path)
+    with _pptx_template_lock:
+        cached = _pptx_templates.get(path)
+        if cached is None or cached[0] != mtime:
+            prs = Presentation(path)
+            slide_ids = prs.slides._sldIdLst
+            for slide_id in list(slide_ids):
+                prs.part.drop_rel(slide_id.rId)
+                slide_ids.remove(slide_id)
+            stripped = BytesIO()
+            prs.save(stripped)
+            stripped.seek(0)
+            # Deep copies are only consistent while no proxy (slides, layouts...)
+            # has been created on the master, so it is never used directly.
+            cached = _pptx_templates[path] = (mtime, Presentation(stripped))
+            log.debug("Parsed presentation template %s", path)
+        return copy.deepcopy(cached[1])
+
+def _slide_layout(prs: Presentation, name: str, default_index: int):
+    layout = prs.slide_layouts.get_by_name(name) if name else None
+    if layout is None:
+        layouts = prs.slide_layouts
+        layout = layouts[min(default_index, len(layouts) - 1)]
+    return layout
+
+def _body_placeholder(slide):
+    for placeholder in slide.placeholders:
+        if placeholder.placeholder_format.type in (PP_PLACEHOLDER.BODY, PP_PLACEHOLDER.OBJECT):
+            return placeholder
+    return None
+
+_PPTX_TITLE_SIZES = (28, 16)
+_PPTX_BODY_SIZES = (24, 12)
+_PPTX_LINE_SPACING = 1.2
+_PPTX_PARAGRAPH_SPACING = 6
+_PPTX_BULLET_INDENT = Inches(0.375)
+
+@functools.lru_cache(maxsize=1)
+def _pptx_metrics_font() -> str:
+    """ReportLab font used to measure slide text; Helvetica runs slightly wider than Calibri."""
+    if PPTX_METRICS_FONT:
+        try:
+            return fonts.register(PPTX_METRICS_FONT)
+        except Exception as e:
+            log.warning("Could not load PPTX_METRICS_FONT %s: %s", PPTX_METRICS_FONT, e)
+    return "Helvetica"
+
+def _text_area(shape, indent: int = 0) -> tuple:
+    """Usable (width, height) of a shape's text frame, in points."""
+    frame = shape.text_frame
+    width = shape.width - frame.margin_left - frame.margin_right - indent
+    height = shape.height - frame.margin_top - frame.margin_bottom
+    return max(width, Pt(1)) / Pt(1), max(height, Pt(1)) / Pt(1)
+
+def _wrapped_line_count(word_widths: list, space: float, limit: float) -> int:
+    lines, current = 1, 0.0
+    for width in word_widths:
+        if current and current + space + width <= limit:
+            current += space + width
+            continue
+        if current:
+            lines += 1
+        # Words wider than the box are broken across lines.
+        breaks = int(width // limit)
+        lines += breaks
+        current = width - breaks * limit
+    return lines
+
+def _fit_text_sizes(jobs: list) -> list:
+    """Return the largest point size at which each job's paragraphs fit its box."""
+    font_name = _pptx_metrics_font()
+    widths = {}
+    for paragraphs, *_ in jobs:
+        for paragraph in paragraphs:
+            for word in paragraph.split():
+                if word not in widths:
+                    widths[word] = _string_width(word, font_name, 1)
+    space = _string_width(" ", font_name, 1)
+
+    sizes = []
+    for paragraphs, width, height, max_size, min_size in jobs:
+        words = [[widths[word] for word in paragraph.split()] for paragraph in paragraphs]
+
+        def fits(size):
+            lines = sum(_wrapped_line_count(w, space, width / size) for w in words)
+            return lines * size * _PPTX_LINE_SPACING + len(words) * _PPTX_PARAGRAPH_SPACING <= height
+
+        low, high = min_size, max_size
+        while low < high:
+            mid = (low + high + 1) // 2
+            if fits(mid):
+                low = mid
+            else:
+                high = mid - 1
+        sizes.append(low)
+    return sizes
+
+def _add_bullets(shape, lines: list, template: str = None) -> list:
+    """Write one paragraph per line into shape's text frame and return the runs."""
+    if not isinstance(lines, list):
+        lines = [lines]
+    frame = shape.text_frame
+    frame.text = ""
+    runs = []
+    for index, line in enumerate(lines):
+        p = frame.paragraphs[0] if index == 0 else frame.add_paragraph()
+        run = p.add_run()
+        run.text = str(line)
+        if not template:
+            run.font.name = "Calibri"
+        p.space_after = Pt(_PPTX_PARAGRAPH_SPACING)
+        runs.append(run)
+    return runs
+
+def _column_shapes(slide, boxes: list) -> list:
+    """Two text frames side by side: the layout's body placeholders, else textboxes."""
+    shapes = [
+        placeholder for placeholder in slide.placeholders
+        if placeholder.placeholder_format.type in (PP_PLACEHOLDER.BODY, PP_PLACEHOLDER.OBJECT)
+    ]
+    if len(shapes) >= 2:
+        return shapes[:2]
+    for shape in shapes:
+        shape._element.getparent().remove(shape._element)
+    shapes = [slide.shapes.add_textbox(*area) for area in boxes]
+    for shape in shapes:
+        shape.text_frame.word_wrap = True
+    return shapes
+
+def _add_pptx_table(slide, data: list, area: list, template: str = None):
+    """Add a native table; the first row of data is the header."""
+    if not isinstance(data, list) or not data or not all(isinstance(row, list) for row in data):
+        raise ValueError("Table slides need 'data' as a non-empty list of rows.")
+    rows = [[str(cell) if cell is not None else "" for cell in row] for row in data]
+    n_cols = max(len(row) for row in rows)
+    left, top, width, height = area
+    row_height = Pt(1) * max(18, min(40, height / Pt(1) / len(rows)))
+    table = slide.shapes.add_table(len(rows), n_cols, left, top, width, int(row_height * len(rows))).table
+
+    # Columns share the width in proportion to their longest cell, none below half an even share.
+    font_name = _pptx_metrics_font()
+    measured = [
+        max(_string_width(row[j], font_name, 1) if j < len(row) else 0 for row in rows) + 1
+        for j in range(n_cols)
+    ]
+    floor = 0.5 / n_cols
+    shares = [max(floor, m / sum(measured)) for m in measured]
+    for j, share in enumerate(shares):
+        table.columns[j].width = int(width * share / sum(shares))
+
+    size = Pt(max(10, min(18, int(row_height / Pt(1) / 2))))
+    for i, row in enumerate(rows):
+        for j in range(n_cols):
+            frame = table.cell(i, j).text_frame
+            frame.text = row[j] if j < len(row) else ""
+            for run in frame.paragraphs[0].runs:
+                run.font.size = size
+                if not template:
+                    run.font.name = "Calibri"
+
+def _add_pptx_chart(slide, slide_data: dict, area: list):
+    """Add a native chart from categories and numeric series."""
+    chart_name = str(slide_data.get("chart_type") or "column").lower()
+    chart_type = _PPTX_CHART_TYPES.get(chart_name)
+    if chart_type is None:
+        raise ValueError(f"Unknown chart_type '{chart_name}', expected one of {', '.join(_PPTX_CHART_TYPES)}")
+    series = slide_data.get("series", [])
+    if isinstance(series, dict):
+        series = [series]
+    if not series or not all(isinstance(item, dict) for item in series):
+        raise ValueError("Chart slides need 'series' as a list of {'name', 'values'} dictionaries.")
+
+    if chart_type == XL_CHART_TYPE.XY_SCATTER:
+        chart_data = XyChartData()
+        for index, item in enumerate(series):
+            points = chart_data.add_series(str(item.get("name") or f"Series {index + 1}"))
+            for x, y in item.get("values", []):
+                points.add_data_point(float(x), float(y))
+    else:
+        chart_data = CategoryChartData()
+        chart_data.categories = [str(c) for c in slide_data.get("categories", [])]
+        for index, item in enumerate(series):
+            values = [float(v) if v is not None else None for v in item.get("values", [])]
+            chart_data.add_series(str(item.get("name") or f"Series {index + 1}"), values)
+
+    chart = slide.shapes.add_chart(chart_type, *area, chart_data).chart
+    is_pie = chart_type in (XL_CHART_TYPE.PIE, XL_CHART_TYPE.DOUGHNUT)
+    chart.has_legend = is_pie or len(series) > 1
+    if chart.has_legend:
+        chart.legend.position = XL_LEGEND_POSITION.BOTTOM
+        chart.legend.include_in_layout = False
+    if is_pie:
+        plot = chart.plots[0]
+        plot.has_data_labels = True
+        plot.data_labels.show_percentage = True
+        plot.data_labels.show_value = False
+        plot.data_labels.number_format = "0%"
+        plot.data_labels.number_format_is_linked = False
+    if slide_data.get("chart_title"):
+        chart.has_title = True
+        chart.chart_title.text_frame.text = str(slide_data["chart_title"])
+
+def _slide_image_source(src: str, images: ImageRegistry):
+    """The slide's "image" if it is an http(s) URL or already in the registry; local paths are refused."""
+    if not src:
+        return None
+    if _is_image_url(src) or images.has(src):
+        return src
+    log.warning("Ignoring slide image %s: only http(s) URLs are allowed", src)
+    return None
+
+def _build_presentation(slides_data: list, title: str, images: ImageRegistry, template: str = None) -> Presentation:
+    prs = _load_presentation(template)
+    # The fixed positions below were laid out for the 10 x 7.5 in default slide.
+    scale_x = prs.slide_width / Inches(10)
+    scale_y = prs.slide_height / Inches(7.5)
+
+    def box(left, top, width=None, height=None):
+        return [
+            int(Inches(v) * (scale_x if i % 2 == 0 else scale_y))
+            for i, v in enumerate((left, top, width, height)) if v is not None
+        ]
+
+    # Font sizes are fitted once every slide's final geometry is known, for the whole deck at once.
+    fit_jobs, fit_targets = [], []
+
+    def fit(shape, runs, sizes, autofit, indent=0):
+        fit_targets.append((runs, autofit))
+        fit_jobs.append(([run.text for run in runs], *_text_area(shape, indent), *sizes))
+
+    slide = prs.slides.add_slide(_slide_layout(prs, "Title Slide", 0))
+    if slide.shapes.title is not None:
+        slide.shapes.title.text = title or ""
+    images.prefetch([s.get("image_query") for s in slides_data if isinstance(s, dict)])
     for slide_data in slides_data:
         if not isinstance(slide_data, dict):
             raise ValueError("Each slide must be a dictionary.")
 
+        slide_type = str(slide_data.get("type") or "content").lower()
+        if slide_type not in _PPTX_SLIDE_TYPES:
+            raise ValueError(f"Unknown slide type '{slide_type}', expected one of {', '.join(_PPTX_SLIDE_TYPES)}")
         slide_title = slide_data.get("title", "Untitled")
-        content_list = slide_data.get("content", [])
-        if not isinstance(content_list, list):
-            content_list = [content_list]
+        autofit = slide_data.get("autofit", True)
 
-        slide_layout = prs.slide_layouts[1]
-        slide = prs.slides.add_slide(slide_layout)
+        layout_name, layout_index = _PPTX_SLIDE_TYPES[slide_type]
+        slide = prs.slides.add_slide(_slide_layout(prs, slide_data.get("layout") or layout_name, layout_index))
 
         title_shape = slide.shapes.title
-        title_shape.text = slide_title
-        for paragraph in title_shape.text_frame.paragraphs:
-            for run in paragraph.runs:
-                run.font.size = Pt(28)
+        if title_shape is not None:
+            title_shape.text = str(slide_title)
+            title_runs = [run for paragraph in title_shape.text_frame.paragraphs for run in paragraph.runs]
+            for run in title_runs:
                 run.font.bold = True
+            fit(title_shape, title_runs, _PPTX_TITLE_SIZES, autofit)
 
-        content_shape = slide.placeholders[1]
-        content_shape.text = ""  
-        font_size = dynamic_font_size(content_list, max_chars=300, base_size=24, min_size=12)
+        if slide_type == "table":
+            _add_pptx_table(slide, slide_data.get("data", []), box(*_PPTX_WIDE_BOX), template)
+            continue
+        if slide_type == "chart":
+            _add_pptx_chart(slide, slide_data, box(*_PPTX_WIDE_BOX))
+            continue
+        if slide_type == "two_column":
+            columns = (slide_data.get("left", []), slide_data.get("right", []))
+            for lines, shape in zip(columns, _column_shapes(slide, [box(*b) for b in _PPTX_COLUMN_BOXES])):
+                runs = _add_bullets(shape, lines, template)
+                fit(shape, runs, _PPTX_BODY_SIZES, autofit, _PPTX_BULLET_INDENT if shape.is_placeholder else 0)
+            continue
+
+        content_shape = _body_placeholder(slide)
+        if content_shape is None:
+            content_shape = slide.shapes.add_textbox(*box(*_PPTX_CONTENT_BOX))
+            content_shape.text_frame.word_wrap = True
+        runs = _add_bullets(content_shape, slide_data.get("content", []), template)
 
-        for line in content_list:
-            p = content_shape.text_frame.add_paragraph()
-            run = p.add_run()
-            run.text = line
-            run.font.size = font_size
-            run.font.name = "Calibri"
-            p.space_after = Pt(6)
-        
         image_query = slide_data.get("image_query")
-        if image_query:
-            image_url = search_image(image_query)
-            if image_url:
-                image_data = requests.get(image_url).content
-                image_stream = BytesIO(image_data)
-                position = slide_data.get("image_position", "right")
-                size = slide_data.get("image_size", "medium")
-                if size == "small":
-                    width = Inches(2)
-                    height = Inches(1.5)
-                elif size == "large":
-                    width = Inches(4)
-                    height = Inches(3)
-                else:
-                    width = Inches(3)
-                    height = Inches(2)
-                if position == "left":
-                    left = Inches(0.5)
-                    top = Inches(1.5)
-                    content_shape.left = Inches(4.5)
-                    content_shape.top = Inches(1.5)
-                    content_shape.width = Inches(5)
-                    content_shape.height = Inches(4)
-                elif position == "right":
-                    left = Inches(5.5)
-                    top = Inches(1.5)
-                    content_shape.left = Inches(0.5)
-                    content_shape.top = Inches(1.5)
-                    content_shape.width = Inches(5)
-                    content_shape.height = Inches(4)
-                elif position == "top":
-                    left = Inches(5.5)
-                    top = Inches(0.5)
-                    content_shape.left = Inches(0.5)
-                    content_shape.top = Inches(2.5)
-                    content_shape.width = Inches(7)
-                    content_shape.height = Inches(3)
-                elif position == "bottom":
-                    left = Inches(5.5)
-                    top = Inches(4.5)
-                    content_shape.left = Inches(0.5)
-                    content_shape.top = Inches(0.5)
-                    content_shape.width = Inches(7)
-                    content_shape.height = Inches(3)
-                else:  
-                    left = Inches(5.5)
-                    top = Inches(1.5)
-                    content_shape.left = Inches(0.5)
-                    content_shape.top = Inches(1.5)
-                    content_shape.width = Inches(5)
-                    content_shape.height = Inches(4)
-                slide.shapes.add_picture(image_stream, left, top, width, height)
-        else:
-            content_shape.left = Inches(0.5)
-            content_shape.top = Inches(1.5)
-            content_shape.width = Inches(7)
-            content_shape.height = Inches(4)
+        image_url = images.url_for_query(image_query) if image_query else _slide_image_source(slide_data.get("image"), images)
+        picture = None
+        if image_url:
+            width, height = _PPTX_IMAGE_SIZES.get(slide_data.get("image_size", "medium"), _PPTX_IMAGE_SIZES["medium"])
+            image_pos, content_box = _PPTX_IMAGE_LAYOUTS.get(slide_data.get("image_position", "right"), _PPTX_IMAGE_LAYOUTS["right"])
+            try:
+                picture = slide.shapes.add_picture(images.stream(image_url), *box(*image_pos, width, height))
+            except Exception as e:
+                log.warning("Could not add image %s to slide: %s", image_url, e)
+        if picture is not None:
+            content_shape.left, content_shape.top, content_shape.width, content_shape.height = box(*content_box)
+        elif not template:
+            content_shape.left, content_shape.top, content_shape.width, content_shape.height = box(*_PPTX_CONTENT_BOX)
+        fit(content_shape, runs, _PPTX_BODY_SIZES, autofit, _PPTX_BULLET_INDENT if content_shape.is_placeholder else 0)
+
+    with _log_phase("fit"):
+        sizes = _fit_text_sizes(fit_jobs)
+    for (runs, autofit), job, size in zip(fit_targets, fit_jobs, sizes):
+        size = size if autofit else job[3]
+        for run in runs:
+            run.font.size = Pt(size)
+    return prs
+
+@mcp.tool()
+@_with_request_id
+def create_presentation(slides_data: list[dict], filename: str = None, persistent: bool = PERSISTENT_FILES, title: str = None, template: str = None) -> dict:
+    folder_path = _generate_unique_folder()
+    filepath, fname = _generate_filename(folder_path, "pptx", filename)
+    images = ImageRegistry()
+    prs = _build_presentation(slides_data, title, images, template)
     prs.save(filepath)
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-    return {"url": _public_url(folder_path, fname)}
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, fname, links)}
+
+_XML_INVALID_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_WORD_HEADER_FILL = "D9E2F3"
+
+def _word_cell_xml(text: str, width: int, header: bool) -> str:
+    text = html.escape(_XML_INVALID_CHARS_RE.sub("", text), quote=False)
+    shading = f'<w:shd w:val="clear" w:color="auto" w:fill="{_WORD_HEADER_FILL}"/>' if header else ""
+    bold = "<w:rPr><w:b/></w:rPr>" if header else ""
+    runs = "<w:br/>".join(f'<w:t xml:space="preserve">{line}</w:t>' for line in text.split("\n"))
+    return f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/>{shading}</w:tcPr><w:p><w:r>{bold}{runs}</w:r></w:p></w:tc>'
+
+def _add_word_table(doc, data: list, header: bool = True):
+    """Append a table to doc, writing its XML in one pass."""
+    rows = [[str(cell) if cell is not None else "" for cell in row] for row in data if isinstance(row, (list, tuple))]
+    if not rows:
+        return None
+    n_cols = max(len(row) for row in rows)
+    section = doc.sections[-1]
+    # EMU -> twentieths of a point (dxa)
+    text_width = (section.page_width - section.left_margin - section.right_margin) // 635
+    lengths = [min(60, max((len(row[j]) for row in rows if j < len(row)), default=0)) + 4 for j in range(n_cols)]
+    widths = [text_width * length // sum(lengths) for length in lengths]
+
+    try:
+        style = f'<w:tblStyle w:val="{doc.styles["Table Grid"].style_id}"/>'
+    except KeyError:
+        style = ""
+    parts = [
+        f"<w:tbl {nsdecls('w')}><w:tblPr>{style}<w:tblW w:w=\"{sum(widths)}\" w:type=\"dxa\"/>"
+        '<w:tblLayout w:type="fixed"/><w:tblLook w:val="04A0" w:firstRow="1" w:lastRow="0" '
+        'w:firstColumn="0" w:lastColumn="0" w:noHBand="0" w:noVBand="1"/></w:tblPr><w:tblGrid>',
+        "".join(f'<w:gridCol w:w="{width}"/>' for width in widths),
+        "</w:tblGrid>",
+    ]
+    for i, row in enumerate(rows):
+        is_header = header and i == 0
+        parts.append("<w:tr><w:trPr><w:tblHeader/></w:trPr>" if is_header else "<w:tr>")
+        parts.extend(
+            _word_cell_xml(row[j] if j < len(row) else "", widths[j], is_header) for j in range(n_cols)
+        )
+        parts.append("</w:tr>")
+    parts.append("</w:tbl>")
+
+    tbl = parse_xml("".join(parts))
+    body = doc.element.body
+    if body.sectPr is not None:
+        body.sectPr.addprevious(tbl)
+    else:
+        body.append(tbl)
+    return tbl
+
+_DOCX_CODE_FONT = "Consolas"
+_DOCX_LIST_STYLES = {"bullet_list_open": "List Bullet", "ordered_list_open": "List Number"}
+
+def _docx_style(doc, name: str, fallback: str = None):
+    try:
+        return doc.styles[name]
+    except KeyError:
+        return doc.styles[fallback] if fallback else None
+
+def _docx_list_style(doc, list_type: str, level: int):
+    base = _DOCX_LIST_STYLES[list_type]
+    return _docx_style(doc, f"{base} {level + 1}" if level else base, base)
+
+def _docx_restart_numbering(doc, style, start: int):
+    """A new numbering instance for an ordered list style, so each list counts from start."""
+    num_pr = style.element.pPr.numPr if style.element.pPr is not None else None
+    if num_pr is None or num_pr.numId is None:
+        return None
+    numbering = doc.part.numbering_part.element
+    abstract_id = numbering.num_having_numId(num_pr.numId.val).abstractNumId.val
+    num = numbering.add_num(abstract_id)
+    num.add_lvlOverride(ilvl=num_pr.ilvl.val if num_pr.ilvl is not None else 0).add_startOverride(start)
+    return num.numId
+
+def _docx_hyperlink(paragraph, url: str):
+    """Append an external w:hyperlink to paragraph and return it, to receive the link's runs."""
+    r_id = paragraph.part.relate_to(url, RT.HYPERLINK, is_external=True)
+    link = OxmlElement("w:hyperlink")
+    link.set(qn("r:id"), r_id)
+    paragraph._p.append(link)
+    return link
+
+def _docx_inline(paragraph, inline, images: list):
+    """Add the runs of a markdown-it inline token to paragraph; images are collected aside."""
+    bold = italic = strike = False
+    link = None
+    for tok in inline.children or []:
+        t = tok.type
+        text = None
+        code = False
+        if t == "text":
+            text = replace_emoji_aliases(tok.content)
+        elif t == "code_inline":
+            text, code = tok.content, True
+        elif t in ("softbreak", "hardbreak"):
+            paragraph.add_run().add_break()
+        elif t in ("strong_open", "strong_close"):
+            bold = t == "strong_open"
+        elif t in ("em_open", "em_close"):
+            italic = t == "em_open"
+        elif t in ("s_open", "s_close"):
+            strike = t == "s_open"
+        elif t == "link_open":
+            href = tok.attrGet("href") or ""
+            link = _docx_hyperlink(paragraph, href) if href.startswith(("http://", "https://", "mailto:")) else None
+        elif t == "link_close":
+            link = None
+        elif t == "image":
+            images.append((tok.attrGet("src"), tok.content or "[Image]"))
+        elif t == "html_inline":
+            if _IMG_TAG_RE.match(tok.content):
+                images.append(_img_tag_source(tok.content))
+            elif _BR_TAG_RE.match(tok.content):
+                paragraph.add_run().add_break()
+        if not text:
+            continue
+        run = paragraph.add_run(_XML_INVALID_CHARS_RE.sub("", text))
+        run.bold, run.italic = bold or None, italic or None
+        if strike:
+            run.font.strike = True
+        if code:
+            run.font.name = _DOCX_CODE_FONT
+        if link is not None:
+            run.font.color.rgb = RGBColor(0x05, 0x63, 0xC1)
+            run.font.underline = True
+            link.append(run._r)
+
+def _docx_image(doc, src: str, alt: str, images: ImageRegistry):
+    try:
+        if src and src.startswith("image_query:"):
+            src = images.url_for_query(src[len("image_query:"):])
+        if not src:
+            raise ValueError("image not found")
+        if not (_is_image_url(src) or images.has(src)):
+            raise ValueError("only http(s) image URLs are allowed")
+        doc.add_picture(images.stream(src), width=Inches(6))
+    except Exception as e:
+        log.warning("Could not add image %s to Word document: %s", src, e)
+        doc.add_paragraph(f"[Image: {alt}]")
+
+def _docx_code(doc, code: str, language: str = None):
+    """A monospace paragraph per code block, coloured with PDF_CODE_STYLE when the language is known."""
+    tokens = None
+    if language and _code_style() is not None:
+        try:
+            tokens = lex(code, get_lexer_by_name(language, stripnl=False, ensurenl=False))
+        except ClassNotFound:
+            log.debug("No lexer for code block language '%s'", language)
+    paragraph = doc.add_paragraph(style=_docx_style(doc, "No Spacing"))
+    for ttype, value in tokens if tokens is not None else [(None, code)]:
+        for i, line in enumerate(_XML_INVALID_CHARS_RE.sub("", value).split("\n")):
+            if i:
+                paragraph.add_run().add_break()
+            if not line:
+                continue
+            run = paragraph.add_run(line)
+            run.font.name = _DOCX_CODE_FONT
+            run.font.size = Pt(9)
+            if ttype is not None:
+                token_style = _token_style(ttype)
+                if token_style["color"]:
+                    run.font.color.rgb = RGBColor.from_string(token_style["color"])
+                run.bold = token_style["bold"] or None
+                run.italic = token_style["italic"] or None
+    paragraph.paragraph_format.space_after = Pt(8)
+
+def _md_inline_text(inline) -> str:
+    return "".join(
+        tok.content if tok.type in ("text", "code_inline") else "\n" if tok.type == "hardbreak" else ""
+        for tok in inline.children or []
+    )
+
+def _render_md_docx(doc, tokens, start: int, end: int, images: ImageRegistry,
+                    list_level: int = -1, list_style=None, num_id=None, quote: bool = False):
+    """Add the blocks of tokens[start:end] to doc, mapping them to the document's Word styles."""
+    first_in_item = True
+    i = start
+    while i < end:
+        tok = tokens[i]
+        block_end = _md_block_end(tokens, i)
+        t = tok.type
+        if t in ("heading_open", "paragraph_open"):
+            if t == "heading_open":
+                style = _docx_style(doc, f"Heading {min(int(tok.tag[1]), 9)}")
+            elif list_style is not None:
+                style = list_style if first_in_item else _docx_style(doc, f"List Continue {list_level + 1}" if list_level else "List Continue", "List Continue")
+            else:
+                style = _docx_style(doc, "Quote") if quote else None
+            paragraph = doc.add_paragraph(style=style)
+            if num_id is not None and style is list_style and first_in_item:
+                num_pr = paragraph._p.get_or_add_pPr().get_or_add_numPr()
+                num_pr.get_or_add_ilvl().val = 0
+                num_pr.get_or_add_numId().val = num_id
+            first_in_item = False
+            pending_images = []
+            _docx_inline(paragraph, tokens[i + 1], pending_images)
+            if not paragraph.runs and not paragraph._p.findall(qn("w:hyperlink")):
+                paragraph._p.getparent().remove(paragraph._p)
+            for src, alt in pending_images:
+                _docx_image(doc, src, alt, images)
+        elif t in ("bullet_list_open", "ordered_list_open"):
+            style = _docx_list_style(doc, t, list_level + 1)
+            nested_num_id = None
+            if t == "ordered_list_open":
+                nested_num_id = _docx_restart_numbering(doc, style, int(tok.attrGet("start") or 1))
+            j = i + 1
+            while j < block_end:
+                item_end = _md_block_end(tokens, j)
+                if tokens[j].type == "list_item_open":
+                    _render_md_docx(doc, tokens, j + 1, item_end, images, list_level + 1, style, nested_num_id, quote)
+                j = item_end + 1
+        elif t == "blockquote_open":
+            _render_md_docx(doc, tokens, i + 1, block_end, images, list_level, list_style, num_id, True)
+        elif t in ("fence", "code_block"):
+            code = tok.content.strip("\n").rstrip()
+            if code:
+                _docx_code(doc, code.expandtabs(4), tok.info.split()[0] if tok.info.strip() else None)
+        elif t == "html_block":
+            for tag in _IMG_TAG_RE.findall(tok.content):
+                _docx_image(doc, *_img_tag_source(tag), images)
+            text = html.unescape(_HTML_TAG_RE.sub("", _IMG_TAG_RE.sub("", tok.content))).strip()
+            if text:
+                doc.add_paragraph(_XML_INVALID_CHARS_RE.sub("", text))
+        elif t == "table_open":
+            rows, header_rows = [], 0
+            row, in_head = [], False
+            for j in range(i, block_end):
+                cell = tokens[j]
+                if cell.type == "inline":
+                    row.append(replace_emoji_aliases(_md_inline_text(cell)))
+                elif cell.type in ("thead_open", "thead_close"):
+                    in_head = cell.type == "thead_open"
+                elif cell.type == "tr_close":
+                    rows.append(row)
+                    row = []
+                    header_rows += in_head
+            _add_word_table(doc, rows, header=header_rows > 0)
+            doc.add_paragraph()
+        i = block_end + 1
+
+def render_markdown_to_docx(doc, md_text: str, images: ImageRegistry = None, tokens: list = None):
+    """Render Markdown into doc from the same markdown-it parse used for PDFs."""
+    if images is None:
+        images = ImageRegistry()
+    md_text = _resolve_image_queries(md_text, images)
+    if _markdown_parser is None:
+        log.warning("markdown-it-py is not installed, adding Markdown to the Word document as plain text")
+        for block in re.split(r"\n\s*\n", md_text):
+            if block.strip():
+                doc.add_paragraph(_XML_INVALID_CHARS_RE.sub("", block.strip()))
+        return
+    if tokens is None:
+        with _log_phase("parse"):
+            tokens = _parse_markdown(md_text)
+    with _log_phase("render"):
+        _render_md_docx(doc, tokens, 0, len(tokens), images)
 
 @mcp.tool()
-def create_word(content: list[dict], filename: str = None, persistent: bool = PERSISTENT_FILES) -> dict:
+@_with_request_id
+def create_word(content: list[dict] = None, filename: str = None, persistent: bool = PERSISTENT_FILES, markdown: list[str] = None) -> dict:
     folder_path = _generate_unique_folder()
     filepath, fname = _generate_filename(folder_path, "docx", filename)
+    images = ImageRegistry()
     doc = Document()
+    content = content or []
     
     log.debug("Start creating Word document")
+    if markdown:
+        render_markdown_to_docx(doc, "\n".join(markdown) if isinstance(markdown, list) else markdown, images)
+    images.prefetch([
+        item.get("query") for item in content
+        if isinstance(item, dict) and item.get("type") in ("image", "image_query")
+    ])
     
     for item in content:
-        log.debug(f"Treatment of the element : {item}")
+        log.debug("Treatment of the element : %s", item)
         if isinstance(item, str):
             doc.add_paragraph(item)
             log.debug("Adding a single paragraph")
@@ -734,15 +2811,14 @@ def create_word(content: list[dict], filename: str = None, persistent: bool = PE
                 }
                 image_query = new_item.get("query")
                 if image_query:
-                    log.debug(f"Image search for the query : {image_query}")
-                    image_url = search_image(image_query)
+                    log.debug("Image search for the query : %s", image_query)
+                    image_url = images.url_for_query(image_query)
                     if image_url:
-                        response = requests.get(image_url)
-                        image_data = BytesIO(response.content)
+                        image_data = images.stream(image_url)
                         doc.add_picture(image_data, width=Inches(6))
                         log.debug("Image successfully added")
                     else:
-                        log.warning(f"Image search for : '{image_query}'")
+                        log.warning("Image search for : '%s'", image_query)
             elif "type" in item:
                 item_type = item.get("type")
                 if item_type == "title":
@@ -758,6 +2834,9 @@ def create_word(content: list[dict], filename: str = None, persistent: bool = PE
                 elif item_type == "paragraph":
                     doc.add_paragraph(item.get("text", ""))
                     log.debug("Paragraph added")
+                elif item_type == "markdown":
+                    render_markdown_to_docx(doc, item.get("text", ""), images)
+                    log.debug("Markdown added")
                 elif item_type == "list":
                     items = item.get("items", [])
                     for i, item_text in enumerate(items):
@@ -771,40 +2850,33 @@ def create_word(content: list[dict], filename: str = None, persistent: bool = PE
                 elif item_type == "image":
                     image_query = item.get("query")
                     if image_query:
-                        log.debug(f"Image search for the query : {image_query}")
-                        image_url = search_image(image_query)
+                        log.debug("Image search for the query : %s", image_query)
+                        image_url = images.url_for_query(image_query)
                         if image_url:
-                            response = requests.get(image_url)
-                            image_data = BytesIO(response.content)
+                            image_data = images.stream(image_url)
                             doc.add_picture(image_data, width=Inches(6))
                             log.debug("Image successfully added")
                         else:
-                            log.warning(f"Image search for : '{image_query}'")
+                            log.warning("Image search for : '%s'", image_query)
                 elif item_type == "table":
-                    data = item.get("data", [])
-                    if data:
-                        table = doc.add_table(rows=len(data), cols=len(data[0]) if data else 0)
-                        for i, row in enumerate(data):
-                            for j, cell in enumerate(row):
-                                table.cell(i, j).text = str(cell)
+                    if _add_word_table(doc, item.get("data", []), item.get("header", True)) is not None:
                         log.debug("Table added")
             elif "text" in item:
                 doc.add_paragraph(item["text"])
                 log.debug("Paragraph added")
     
     doc.save(filepath)
-    log.debug(f"Document registered at : {filepath}")
+    log.debug("Document registered at : %s", filepath)
     
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-        log.debug("Cleaning up temporary files")
-    
-    return {"url": _public_url(folder_path, fname)}
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, fname, links)}
 
 @mcp.tool()
+@_with_request_id
 def generate_and_archive(files_data: list[dict], archive_format: str = "zip", archive_name: str = None, persistent: bool = PERSISTENT_FILES) -> dict:
     folder_path = _generate_unique_folder()
     generated_files = []
+    images = ImageRegistry()
     for file_info in files_data:
         filename = file_info.get("filename")
         content = file_info.get("content")
@@ -826,53 +2898,11 @@ def generate_and_archive(files_data: list[dict], archive_format: str = "zip", ar
                 else:
                     md_text = content
 
-                def replace_image_query(match):
-                    query = match.group(1).strip()
-                    log.debug(f"Found image_query placeholder: '{query}'")
-                    image_url = search_image(query)
-                    if image_url:
-                        tag = f'<img src="{image_url}" alt="Image search: {query}" />'
-                        log.debug(f"Replaced image_query '{query}' with {image_url}")
-                    else:
-                        result_tag = ""
-                        log.warning(f"No image found for '{query}'")
-                    return tag
-
-                md_text = re.sub(r'!\[[^\]]*\]\(image_query:([^)]+)\)', replace_image_query, md_text)
-                log.debug(f"Markdown after replacement for {filename}:\n{md_text}")
-
-                html = markdown2.markdown(
-                    md_text,
-                    extras=[
-                        'fenced-code-blocks',
-                        'tables',
-                        'break-on-newline',
-                        'cuddled-lists',
-                    ]
-                )
-                log.debug(f"HTML generated for {filename}:\n{html}")
+                md_text = _resolve_image_queries(md_text, images)
 
-                soup = BeautifulSoup(html, "html.parser")
-                story = render_html_elements(soup)
-
-                if not story:
-                    log.warning(f"Story empty for {filename}, adding fallback text.")
-                    story = [Paragraph("Empty Content", styles["CustomNormal"])]
-
-                doc = SimpleDocTemplate(
-                    filepath,
-                    topMargin=72,
-                    bottomMargin=72,
-                    leftMargin=72,
-                    rightMargin=72
-                )
-                try:
-                    doc.build(story)
-                    log.debug(f"PDF '{filename}' successfully created in the archive.")
-                except Exception as e:
-                    log.error(f"Error during PDF build for '{filename}': {e}", exc_info=True)
-                    fallback_story = [Paragraph("Error generating PDF", styles["CustomNormal"])]
-                    doc.build(fallback_story)
+                if not _build_pdf_parallel(filepath, md_text, images):
+                    _build_pdf(filepath, md_text, images)
+                log.debug("PDF '%s' created in the archive.", filename)
             elif format_type == "xlsx":
                 wb = Workbook()
                 ws = wb.active
@@ -899,105 +2929,21 @@ def generate_and_archive(files_data: list[dict], archive_format: str = "zip", ar
                         )
                 elif not isinstance(parsed_content, list):
                     raise ValueError(f"Invalid format for pptx content: expected list, got '{type(parsed_content).__name__}'")
-                prs = Presentation()
-                title_slide_layout = prs.slide_layouts[0]
-                slide = prs.slides.add_slide(title_slide_layout)
-                title_shape = slide.shapes.title
-                title_shape.text = title_param or "Presentation"
-                for slide_data in parsed_content:
-                    if not isinstance(slide_data, dict):
-                        raise ValueError("Each slide must be a dictionary.")
-                    title = slide_data.get("title", "Untitled")
-                    content_list = slide_data.get("content", [])
-                    if not isinstance(content_list, list):
-                        content_list = [content_list]
-                        
-                    slide_layout = prs.slide_layouts[1]
-                    slide = prs.slides.add_slide(slide_layout)
-                    
-                    title_shape = slide.shapes.title
-                    title_shape.text = title
-                    for paragraph in title_shape.text_frame.paragraphs:
-                        for run in paragraph.runs:
-                            run.font.size = Pt(28)
-                            run.font.bold = True
-                            
-                    content_shape = slide.placeholders[1]
-                    content_shape.text = ""
-                    font_size = dynamic_font_size(content_list, max_chars=300, base_size=24, min_size=12)
-
-                    for line in content_list:
-                        p = content_shape.text_frame.add_paragraph()
-                        run = p.add_run()
-                        run.text = line
-                        run.font.size = font_size
-                        p.space_after = Pt(6)
-                        
-                    image_query = slide_data.get("image_query")
-                    if image_query:
-                        image_url = search_image(image_query)
-                        if image_url:
-                            image_data = requests.get(image_url).content
-                            image_stream = BytesIO(image_data)
-                            position = slide_data.get("image_position", "right")
-                            size = slide_data.get("image_size", "medium")
-                            if size == "small":
-                                width = Inches(2)
-                                height = Inches(1.5)
-                            elif size == "large":
-                                width = Inches(4)
-                                height = Inches(3)
-                            else:
-                                width = Inches(3)
-                                height = Inches(2)
-                            if position == "left":
-                                left = Inches(0.5)
-                                top = Inches(1.5)
-                                content_shape.left = Inches(4.5)
-                                content_shape.top = Inches(1.5)
-                                content_shape.width = Inches(5)
-                                content_shape.height = Inches(4)
-                            elif position == "right":
-                                left = Inches(5.5)
-                                top = Inches(1.5)
-                                content_shape.left = Inches(0.5)
-                                content_shape.top = Inches(1.5)
-                                content_shape.width = Inches(5)
-                                content_shape.height = Inches(4)
-                            elif position == "top":
-                                left = Inches(5.5)
-                                top = Inches(0.5)
-                                content_shape.left = Inches(0.5)
-                                content_shape.top = Inches(2.5)
-                                content_shape.width = Inches(7)
-                                content_shape.height = Inches(3)
-                            elif position == "bottom":
-                                left = Inches(5.5)
-                                top = Inches(4.5)
-                                content_shape.left = Inches(0.5)
-                                content_shape.top = Inches(0.5)
-                                content_shape.width = Inches(7)
-                                content_shape.height = Inches(3)
-                            else:
-                                left = Inches(5.5)
-                                top = Inches(1.5)
-                                content_shape.left = Inches(0.5)
-                                content_shape.top = Inches(1.5)
-                                content_shape.width = Inches(5)
-                                content_shape.height = Inches(4)
-                            slide.shapes.add_picture(image_stream, left, top, width, height)
-                    else:
-                        content_shape.left = Inches(0.5)
-                        content_shape.top = Inches(1.5)
-                        content_shape.width = Inches(7)
-                        content_shape.height = Inches(4)
+                prs = _build_presentation(parsed_content, title_param or "Presentation", images, file_info.get("template"))
                 prs.save(filepath)
             elif format_type == "docx":
                 doc = Document()
                 log.debug("Start creating Word document")
+                if file_info.get("markdown"):
+                    markdown = file_info["markdown"]
+                    render_markdown_to_docx(doc, "\n".join(markdown) if isinstance(markdown, list) else markdown, images)
                 if isinstance(content, list):
+                    images.prefetch([
+                        item.get("query") for item in content
+                        if isinstance(item, dict) and item.get("type") in ("image", "image_query")
+                    ])
                     for item in content:
-                        log.debug(f"Treatment of the element : {item}")
+                        log.debug("Treatment of the element : %s", item)
                         if isinstance(item, str):
                             doc.add_paragraph(item)
                             log.debug("Adding a single paragraph")
@@ -1009,15 +2955,14 @@ def generate_and_archive(files_data: list[dict], archive_format: str = "zip", ar
                                 }
                                 image_query = new_item.get("query")
                                 if image_query:
-                                    log.debug(f"Image search for the query : {image_query}")
-                                    image_url = search_image(image_query)
+                                    log.debug("Image search for the query : %s", image_query)
+                                    image_url = images.url_for_query(image_query)
                                     if image_url:
-                                        response = requests.get(image_url)
-                                        image_data = BytesIO(response.content)
+                                        image_data = images.stream(image_url)
                                         doc.add_picture(image_data, width=Inches(6))
                                         log.debug("Image successfully added")
                                     else:
-                                        log.warning(f"Failed image search for : '{image_query}'")
+                                        log.warning("Failed image search for : '%s'", image_query)
                             elif "type" in item:
                                 item_type = item.get("type")
                                 if item_type == "title":
@@ -1033,6 +2978,9 @@ def generate_and_archive(files_data: list[dict], archive_format: str = "zip", ar
                                 elif item_type == "paragraph":
                                     doc.add_paragraph(item.get("text", ""))
                                     log.debug("Paragraph added")
+                                elif item_type == "markdown":
+                                    render_markdown_to_docx(doc, item.get("text", ""), images)
+                                    log.debug("Markdown added")
                                 elif item_type == "list":
                                     items = item.get("items", [])
                                     for i, item_text in enumerate(items):
@@ -1046,36 +2994,30 @@ def generate_and_archive(files_data: list[dict], archive_format: str = "zip", ar
                                 elif item_type == "image":
                                     image_query = item.get("query")
                                     if image_query:
-                                        log.debug(f"Image search for the query : {image_query}")
-                                        image_url = search_image(image_query)
+                                        log.debug("Image search for the query : %s", image_query)
+                                        image_url = images.url_for_query(image_query)
                                         if image_url:
-                                            response = requests.get(image_url)
-                                            image_data = BytesIO(response.content)
+                                            image_data = images.stream(image_url)
                                             doc.add_picture(image_data, width=Inches(6))
                                             log.debug("Image successfully added")
                                         else:
-                                            log.warning(f"Failed image search for : '{image_query}'")
+                                            log.warning("Failed image search for : '%s'", image_query)
                                 elif item_type == "table":
-                                    data = item.get("data", [])
-                                    if data:
-                                        table = doc.add_table(rows=len(data), cols=len(data[0]) if data else 0)
-                                        for i, row in enumerate(data):
-                                            for j, cell in enumerate(row):
-                                                table.cell(i, j).text = str(cell)
+                                    if _add_word_table(doc, item.get("data", []), item.get("header", True)) is not None:
                                         log.debug("Table added")
                             elif "text" in item:
                                 doc.add_paragraph(item["text"])
                                 log.debug("Paragraph added")
-                else:
-                    doc.add_paragraph(str(content))
+                elif content:
+                    render_markdown_to_docx(doc, str(content), images)
                 doc.save(filepath)
-                log.debug(f"Word document saved at : {filepath}")
+                log.debug("Word document saved at : %s", filepath)
             else:
                 with open(filepath, "w", encoding="utf-8") as f:
                     f.write(content)
             generated_files.append(filepath)
         except Exception as e:
-            log.error(f"Error processing file '{filename}': {e}")
+            log.error("Error processing file '%s': %s", filename, e)
             raise 
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
     if archive_format.lower() == "7z":
@@ -1096,9 +3038,139 @@ def generate_and_archive(files_data: list[dict], archive_format: str = "zip", ar
         with zipfile.ZipFile(archive_path, 'w') as zipf:
             for file_path in generated_files:
                 zipf.write(file_path, os.path.relpath(file_path, folder_path))
-    if not persistent:
-        _cleanup_files(folder_path, FILES_DELAY)
-    return {"url": _public_url(folder_path, archive_filename)}
+    links = _finalize_export(folder_path, persistent)
+    return {"url": _public_url(folder_path, archive_filename, links)}
+
+DOCUMENT_SET_FORMATS = ("pdf", "docx", "pptx", "html")
+_SLIDE_MAX_LINES = 8
+
+def _markdown_to_slides(tokens, title: str = None) -> list[dict]:
+    """Cut a markdown-it token stream into slides_data: one slide per H1/H2 section."""
+    slides = []
+    current = {"title": title or "Introduction", "content": []}
+
+    def flush():
+        if current["content"] or current.get("image"):
+            lines = current["content"] or [""]
+            for index in range(0, len(lines), _SLIDE_MAX_LINES):
+                slide = dict(current, content=lines[index:index + _SLIDE_MAX_LINES])
+                if index:
+                    slide["title"] = f"{current['title']} (cont.)"
+                    slide.pop("image", None)
+                slides.append(slide)
+
+    def add_images(sources):
+        for src in sources:
+            if src and "image" not in current:
+                current["image"] = src
+
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        t = tok.type
+        if t == "heading_open" and tok.tag in ("h1", "h2"):
+            flush()
+            current = {"title": replace_emoji_aliases(_md_inline_text(tokens[i + 1])) or "Untitled", "content": []}
+            i += 2
+            continue
+        elif t in ("list_item_open", "list_item_close"):
+            depth += tok.nesting
+        elif t == "inline":
+            add_images(
+                child.attrGet("src") if child.type == "image" else _img_tag_source(child.content)[0]
+                for child in tok.children or []
+                if child.type == "image" or (child.type == "html_inline" and _IMG_TAG_RE.match(child.content))
+            )
+            text = replace_emoji_aliases(_md_inline_text(tok)).strip()
+            if text:
+                current["content"].append("  " * max(0, depth - 1) + text)
+        elif t in ("fence", "code_block"):
+            current["content"].extend(line for line in tok.content.rstrip("\n").split("\n") if line.strip())
+        elif t == "html_block":
+            add_images(_img_tag_source(tag)[0] for tag in _IMG_TAG_RE.findall(tok.content))
+        elif t == "table_open":
+            block_end = _md_block_end(tokens, i)
+            rows, row = [], []
+            for j in range(i, block_end):
+                if tokens[j].type == "inline":
+                    row.append(_md_inline_text(tokens[j]))
+                elif tokens[j].type == "tr_close":
+                    rows.append(row)
+                    row = []
+            flush()
+            slides.append({"type": "table", "title": current["title"], "data": rows})
+            current = {"title": f"{current['title']} (cont.)", "content": []}
+            i = block_end + 1
+            continue
+        i += 1
+    flush()
+    return slides
+
+def _render_document_set_format(fmt: str, filepath: str, source: str, md_text: str, tokens, title: str, images: ImageRegistry):
+    if fmt == "pdf":
+        if not _build_pdf_parallel(filepath, md_text, images):
+            _build_pdf(filepath, md_text, images, tokens)
+    elif fmt == "docx":
+        doc = Document()
+        if title:
+            doc.core_properties.title = title
+        render_markdown_to_docx(doc, md_text, images, tokens)
+        doc.save(filepath)
+    elif fmt == "pptx":
+        prs = _build_presentation(_markdown_to_slides(tokens, title), title or "Presentation", images)
+        prs.save(filepath)
+    elif fmt == "html":
+        # markdown-it's HTML renderer rewrites image tokens, so the page gets its own parse.
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write(_build_html(source, images, title))
+
+@mcp.tool()
+@_with_request_id
+def create_document_set(markdown: list[str], formats: list[str] = None, filename: str = None, title: str = None, persistent: bool = PERSISTENT_FILES) -> dict:
+    formats = list(dict.fromkeys(str(f).lower().lstrip(".") for f in (formats or ["pdf", "docx"])))
+    unknown = [f for f in formats if f not in DOCUMENT_SET_FORMATS]
+    if unknown:
+        raise ValueError(f"Unsupported format(s) {', '.join(unknown)}, expected {', '.join(DOCUMENT_SET_FORMATS)}")
+    if "pptx" in formats and _markdown_parser is None:
+        raise ValueError("pptx output needs markdown-it-py")
+
+    folder_path = _generate_unique_folder()
+    base = os.path.splitext(os.path.basename(filename))[0] if filename else f"export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    images = ImageRegistry()
+    source = "\n".join(markdown) if isinstance(markdown, list) else markdown
+    md_text = _resolve_image_queries(source, images)
+    tokens = None
+    if _markdown_parser is not None:
+        with _log_phase("parse"):
+            tokens = _parse_markdown(md_text)
+    with _log_phase("images"):
+        sources = [_img_tag_source(tag)[0] for tag in _IMG_TAG_RE.findall(md_text)]
+        for token in tokens or ():
+            sources += [child.attrGet("src") for child in token.children or () if child.type == "image"]
+        for src in dict.fromkeys(filter(_is_image_url, sources)):
+            try:
+                images.get_bytes(src)
+            except Exception as e:
+                log.warning("Could not fetch image %s: %s", src, e)
+
+    # Images are fetched and the Markdown parsed above, once for every format.
+    targets = {fmt: _generate_filename(folder_path, fmt, f"{base}.{fmt}") for fmt in formats}
+    try:
+        with ThreadPoolExecutor(max_workers=len(formats)) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, _render_document_set_format,
+                            fmt, filepath, source, md_text, tokens, title, images)
+                for fmt, (filepath, _) in targets.items()
+            ]
+            for future in futures:
+                future.result()
+    except Exception:
+        _remove_export_folder(folder_path)
+        raise
+
+    links = _finalize_export(folder_path, persistent)
+    return {"urls": {fmt: _public_url(folder_path, fname, links) for fmt, (_, fname) in targets.items()}}
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
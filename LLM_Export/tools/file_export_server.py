@@ -1,30 +1,123 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 import os
+import re
 import pathlib
+import base64
+import hashlib
+import hmac
+import time
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
 
 EXPORT_DIR_ENV = os.getenv("FILE_EXPORT_DIR")
 EXPORT_DIR = (EXPORT_DIR_ENV or r"C:\temp\output").rstrip("/")
 
 os.makedirs(EXPORT_DIR, exist_ok=True)
 
+SIGNING_KEY = (os.getenv("FILE_EXPORT_SIGNING_KEY") or "").encode()
+EXPORT_STORAGE = os.getenv("EXPORT_STORAGE", "local").strip().lower()
+EXPORT_S3_BUCKET = os.getenv("EXPORT_S3_BUCKET")
+EXPORT_S3_PREFIX = os.getenv("EXPORT_S3_PREFIX", "").strip("/")
+EXPORT_S3_ENDPOINT_URL = os.getenv("EXPORT_S3_ENDPOINT_URL")
+EXPORT_S3_REGION = os.getenv("EXPORT_S3_REGION")
+
+if EXPORT_STORAGE == "s3":
+    if boto3 is None:
+        raise RuntimeError("EXPORT_STORAGE=s3 needs boto3")
+    _s3 = boto3.client("s3", endpoint_url=EXPORT_S3_ENDPOINT_URL or None, region_name=EXPORT_S3_REGION or None)
+else:
+    _s3 = None
+
+_EXPORT_ROOT = os.path.join(os.path.realpath(EXPORT_DIR), "")
+_EXPORT_FOLDER_RE = re.compile(r"^export_(?P<prefix>[0-9a-f]{2})[0-9a-f]*_(?P<date>\d{8})_\d{6}$")
+
 app = FastAPI()
 
+def _export_file_path(folder_name: str, filename: str) -> str:
+    """Resolve a file in either the sharded (<date>/<prefix>/<folder>) or the flat layout."""
+    match = _EXPORT_FOLDER_RE.match(folder_name)
+    if match:
+        sharded = os.path.join(EXPORT_DIR, match.group("date"), match.group("prefix"), folder_name, filename)
+        if os.path.isfile(sharded):
+            return sharded
+    return os.path.join(EXPORT_DIR, folder_name, filename)
+
+def _url_signature(folder_name: str, filename: str, expires: int, size: int) -> str:
+    """Same HMAC as file_export_mcp._url_signature; FILE_EXPORT_SIGNING_KEY must match on both sides."""
+    message = f"{folder_name}/{filename}:{expires}:{size}".encode()
+    digest = hmac.new(SIGNING_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def _check_signature(folder_name: str, filename: str, expires: int, size: int, sig: str) -> dict:
+    """Validate a signed link from its query string alone and return its cache headers."""
+    if not hmac.compare_digest(sig, _url_signature(folder_name, filename, expires, size)):
+        raise HTTPException(status_code=403, detail="Invalid link signature")
+    if not expires:
+        return {"Cache-Control": "public, max-age=31536000, immutable"}
+    remaining = int(expires - time.time())
+    if remaining <= 0:
+        # The export was removed by the FILES_DELAY cleanup at this time; no need to look for it.
+        raise HTTPException(status_code=410, detail="Link expired")
+    return {"Cache-Control": f"public, max-age={remaining}", "Expires": _http_date(expires)}
+
+def _http_date(timestamp: float) -> str:
+    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(timestamp))
+
+class ExportStaticFiles(StaticFiles):
+    """StaticFiles that never serves dot-files such as the export index."""
+    async def get_response(self, path: str, scope):
+        if any(part.startswith(".") for part in pathlib.PurePath(path).parts):
+            raise HTTPException(status_code=404, detail="File not found")
+        return await super().get_response(path, scope)
+
 @app.get("/files/{folder_name}/{filename}")
-async def serve_file(folder_name: str, filename: str):
-    file_path = os.path.join(EXPORT_DIR, folder_name, filename)
-    if not os.path.isfile(file_path):
+async def serve_file(folder_name: str, filename: str, expires: int = 0, size: int = 0, sig: str = ""):
+    if folder_name.startswith(".") or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="File not found")
+    headers = _check_signature(folder_name, filename, expires, size, sig) if SIGNING_KEY else {}
+    if _s3 is not None:
+        return await _serve_s3_file(folder_name, filename, headers)
+    file_path = _export_file_path(folder_name, filename)
+    # With EXPORT_DEDUP the file may be a symlink into EXPORT_DIR/.blobs; follow it, but never out of EXPORT_DIR.
+    real_path = os.path.realpath(file_path)
+    if not real_path.startswith(_EXPORT_ROOT) or not os.path.isfile(real_path):
         raise HTTPException(status_code=404, detail="File not found")
     return FileResponse(
-        path=file_path,
+        path=real_path,
         media_type='application/octet-stream',
         filename=filename, 
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers={"Content-Disposition": f"attachment; filename={filename}", **headers}
+    )
+
+async def _serve_s3_file(folder_name: str, filename: str, headers: dict):
+    """Stream an object from the bucket in chunks instead of buffering it."""
+    key = f"{folder_name}/{filename}"
+    if EXPORT_S3_PREFIX:
+        key = f"{EXPORT_S3_PREFIX}/{key}"
+    try:
+        obj = await run_in_threadpool(_s3.get_object, Bucket=EXPORT_S3_BUCKET, Key=key)
+    except _s3.exceptions.NoSuchKey:
+        raise HTTPException(status_code=404, detail="File not found")
+    return StreamingResponse(
+        obj["Body"].iter_chunks(64 * 1024),
+        media_type='application/octet-stream',
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Length": str(obj["ContentLength"]),
+            **headers,
+        },
     )
 
-app.mount("/files", StaticFiles(directory=EXPORT_DIR), name="files")
+if not SIGNING_KEY:
+    # Signed links only go through serve_file; the static mount would serve the same files unchecked.
+    app.mount("/files", ExportStaticFiles(directory=EXPORT_DIR), name="files")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=9003)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=9003)